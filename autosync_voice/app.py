@@ -3,6 +3,7 @@
 
 """Main module of autosync_voice."""
 
+import functools
 import logging
 import time
 import tomllib
@@ -15,14 +16,18 @@ from click_default_group import DefaultGroup  # type: ignore[import-untyped]
 
 import autosync_voice.devices
 import autosync_voice.export
+import autosync_voice.governor
 import autosync_voice.importer
 import autosync_voice.improve
 import autosync_voice.matchmake
+import autosync_voice.pcm_cache
+import autosync_voice.policy
 import autosync_voice.processed_list
 import autosync_voice.sync
 
 if typing.TYPE_CHECKING:
     from autosync_voice.config import Config
+    from autosync_voice.governor import Stage
 
     F = typing.TypeVar('F', bound=typing.Callable[..., typing.Any])
 
@@ -54,10 +59,47 @@ def cli(ctx: click.Context, config: str, debug: bool) -> None:  # noqa: FBT001
             wrapper_class=structlog.make_filtering_bound_logger(logging.INFO),
         )
 
+    # Be nice to the rest of the machine
+    autosync_voice.governor.apply_to_process(cfg['governor'])
+
 
 _command: typing.Callable[['F'], 'F'] = cli.command
 
 
+def _cmd_prefix(config: 'Config', stage: 'Stage') -> tuple[str, ...]:
+    sconfig = config['governor']['stages'][stage]
+    return autosync_voice.governor.cmd_prefix(sconfig)
+
+
+@functools.cache
+def _pcm_cache_at(
+    directory: str,
+    max_size_mb: int,
+    rate: int,
+) -> autosync_voice.pcm_cache.PCMCache:
+    return autosync_voice.pcm_cache.PCMCache(
+        Path(directory),
+        max_size=max_size_mb * 1024 * 1024,
+        rate=rate,
+    )
+
+
+def _pcm_cache(config: 'Config') -> autosync_voice.pcm_cache.PCMCache | None:
+    if 'cache' not in config:
+        return None
+    c = config['cache']
+    return _pcm_cache_at(c['dir'], c['max_size_mb'], c['rate'])
+
+
+def _run(
+    config: 'Config',
+    stage: 'Stage',
+    jobs: typing.Iterable[typing.Callable[[], None]],
+) -> None:
+    sconfig = config['governor']['stages'][stage]
+    autosync_voice.governor.run(sconfig, stage, jobs)
+
+
 @_command
 @click.pass_context
 def detect_devices(ctx: click.Context) -> None:
@@ -77,11 +119,22 @@ def _do_everything(config: 'Config') -> None:
         click.echo(f'{device.name} has been newly plugged in')
         log.debug('processing newly plugged', device=device.name)
         mountpoint = device.check_mount()
-        autosync_voice.importer.import_files(
+        start = time.monotonic()
+        import_sconfig = config['governor']['stages']['import']
+        duration = autosync_voice.importer.import_files(
             mountpoint,
             device.name,
             config['devices'][device.name]['glob'],
             Path(config['storage']['raw']),
+            segment_len=config['flac']['segment_len'],
+            # import is never deferred, no room for parallelism means serial
+            workers=max(1, autosync_voice.governor.workers(import_sconfig)),
+            cmd_prefix=_cmd_prefix(config, 'import'),
+        )
+        elapsed = time.monotonic() - start
+        click.echo(
+            f'{device.name} imported {duration:.0f}s of audio '
+            f'in {elapsed:.0f}s',
         )
         device.mark_imported(config)
         device.umount()
@@ -129,11 +182,55 @@ def matchmake(ctx: click.Context) -> None:
             click.echo(f'{o.relative_to(day_dir)} = {f1.stem} + {f2.stem}')
 
 
+def _rejected(o: Path) -> Path:
+    return o.with_suffix('.rejected')
+
+
+def _matched(config: 'Config') -> set[Path]:
+    return {
+        f
+        for matches in _matchmake(config).values()
+        for o, pair in matches.items()
+        if not _rejected(o).exists()  # treat them as unmatched instead
+        for f in pair
+    }
+
+
+def _is_wanted(
+    config: 'Config',
+    stage: typing.Literal['export', 'improve'],
+    raw: Path,
+    matched: set[Path],
+) -> bool:
+    log = structlog.get_logger()
+    policy = config['policy'][stage]
+    kind = autosync_voice.policy.classify(raw, config['devices'], matched)
+    if autosync_voice.policy.is_wanted(policy, kind):
+        return True
+    log.debug('skipping by policy', file=raw, kind=kind, policy=policy)
+    return False
+
+
+def _sync_one(config: 'Config', o: Path, f1: Path, f2: Path) -> None:
+    cmd_prefix = _cmd_prefix(config, 'sync')
+    cache = _pcm_cache(config)
+    try:
+        autosync_voice.sync.sync(o, f1, f2, cmd_prefix=cmd_prefix, cache=cache)
+    except autosync_voice.sync.SyncError as ex:
+        click.echo(f'not merging {f1} and {f2}: {ex.message}')
+        o.parent.mkdir(parents=True, exist_ok=True)
+        reason = f'{f1}\n{f2}\n{ex.message}\n'
+        _rejected(o).write_text(reason)  # remove it to retry
+
+
 def _sync_all(config: 'Config') -> None:
-    for matches in _matchmake(config).values():
-        for o, (f1, f2) in matches.items():
-            if not o.exists():
-                autosync_voice.sync.sync(o, f1, f2)
+    def jobs() -> typing.Iterator[typing.Callable[[], None]]:
+        for matches in _matchmake(config).values():
+            for o, (f1, f2) in matches.items():
+                if not o.exists() and not _rejected(o).exists():
+                    yield functools.partial(_sync_one, config, o, f1, f2)
+
+    _run(config, 'sync', jobs())
 
 
 @_command
@@ -153,15 +250,31 @@ def sync(out: str, in_left: str, in_right: str) -> None:
     autosync_voice.sync.sync(Path(out), Path(in_left), Path(in_right))
 
 
+def _export_one(config: 'Config', o: Path, f: Path) -> None:
+    click.echo(f'exporting to {o}')
+    cmd_prefix = _cmd_prefix(config, 'export')
+    cache = _pcm_cache(config)
+    autosync_voice.export.export(o, f, cmd_prefix=cmd_prefix, cache=cache)
+    autosync_voice.processed_list.mark_processed(config['storage'], o)
+
+
 def _export_all(config: 'Config') -> None:
     config_storage = config['storage']
-    for f in Path(config_storage['raw']).rglob('*.flac'):
-        r = f.relative_to(f.parent.parent.parent)
-        o = (Path(config_storage['processed']) / r).with_suffix('.opus')
-        if not autosync_voice.processed_list.is_processed(config_storage, o):
-            click.echo(f'exporting to {o}')
-            autosync_voice.export.export(o, f)
-            autosync_voice.processed_list.mark_processed(config_storage, o)
+
+    def jobs() -> typing.Iterator[typing.Callable[[], None]]:
+        matched = _matched(config)
+        for f in Path(config_storage['raw']).rglob('*.flac'):
+            if not _is_wanted(config, 'export', f, matched):
+                continue
+            r = f.relative_to(f.parent.parent.parent)
+            o = (Path(config_storage['processed']) / r).with_suffix('.opus')
+            if not autosync_voice.processed_list.is_processed(
+                config_storage,
+                o,
+            ):
+                yield functools.partial(_export_one, config, o, f)
+
+    _run(config, 'export', jobs())
 
 
 @_command
@@ -180,16 +293,44 @@ def export(out: str, inp: str) -> None:
     autosync_voice.export.export(Path(out), Path(inp))
 
 
+def _improve_one(config: 'Config', i: Path, f: Path, raw: Path) -> None:
+    click.echo(f'improving to {i}')
+    cmd_prefix = _cmd_prefix(config, 'improve')
+    # the raw one is likely cached after export, and it's lossless too;
+    # the export is only used if the raw one is gone, without caching it
+    raw_exists = raw.exists()
+    autosync_voice.improve.improve(
+        i,
+        raw if raw_exists else f,
+        cmd_prefix=cmd_prefix,
+        cache=_pcm_cache(config) if raw_exists else None,
+        vad=config['improve']['vad'],
+        attenuation_db=config['improve']['attenuation_db'],
+        unvoiced_attenuation_db=config['improve']['unvoiced_attenuation_db'],
+    )
+    autosync_voice.processed_list.mark_processed(config['storage'], i)
+
+
 def _improve_all(config: 'Config') -> None:
     config_storage = config['storage']
-    for f in Path(config_storage['processed']).rglob('*.opus'):
-        if str(f).endswith('.i.opus'):
-            continue
-        i = f.with_suffix('.i.opus')
-        if not autosync_voice.processed_list.is_processed(config_storage, i):
-            click.echo(f'improving to {i}')
-            autosync_voice.improve.improve(i, f)
-            autosync_voice.processed_list.mark_processed(config_storage, i)
+
+    def jobs() -> typing.Iterator[typing.Callable[[], None]]:
+        matched = _matched(config)
+        for f in Path(config_storage['processed']).rglob('*.opus'):
+            if str(f).endswith('.i.opus'):
+                continue
+            r = f.relative_to(config_storage['processed'])
+            raw = (Path(config_storage['raw']) / r).with_suffix('.flac')
+            if not _is_wanted(config, 'improve', raw, matched):
+                continue
+            i = f.with_suffix('.i.opus')
+            if not autosync_voice.processed_list.is_processed(
+                config_storage,
+                i,
+            ):
+                yield functools.partial(_improve_one, config, i, f, raw)
+
+    _run(config, 'improve', jobs())
 
 
 @_command
@@ -5,12 +5,24 @@
 
 import typing
 
+from autosync_voice.governor import IONICE_CLASSES, STAGES
+from autosync_voice.policy import POLICIES
+
+if typing.TYPE_CHECKING:
+    from autosync_voice.governor import IONiceClass, Stage
+    from autosync_voice.policy import Policy
+
 
 class Config(typing.TypedDict):
     """Type definition for the entire config."""
 
     storage: 'StorageConfig'
     devices: dict[str, 'DeviceConfig']
+    policy: 'PolicyConfig'
+    governor: 'GovernorConfig'
+    flac: 'FlacConfig'
+    cache: typing.NotRequired['CacheConfig']
+    improve: 'ImproveConfig'
 
 
 class StorageConfig(typing.TypedDict):
@@ -22,27 +34,170 @@ class StorageConfig(typing.TypedDict):
     processed_list: str
 
 
+class PolicyConfig(typing.TypedDict):
+    """Which recordings to produce outputs for, per stage."""
+
+    export: 'Policy'
+    improve: 'Policy'
+
+
+class ImproveConfig(typing.TypedDict):
+    """How to improve recordings."""
+
+    vad: bool  # denoise just the voiced regions
+    attenuation_db: float  # of noise by DeepFilterNet, at most
+    unvoiced_attenuation_db: float  # with vad, of what's not voiced
+
+
+class CacheConfig(typing.TypedDict):
+    """Where and how much of decoded PCM to keep between the stages."""
+
+    dir: str
+    max_size_mb: int  # 0 for unlimited
+    rate: int
+
+
+class FlacConfig(typing.TypedDict):
+    """How to encode FLAC."""
+
+    segment_len: float  # seconds, encode longer files in parallel; 0 = never
+
+
+class GovernorConfig(typing.TypedDict):
+    """How nice to be to the rest of the machine."""
+
+    nice: int  # extra niceness of the whole process, 0 to leave it be
+    ionice: 'IONiceClass'  # of the whole process
+    stages: dict['Stage', 'StageConfig']
+
+
+class StageConfig(typing.TypedDict):
+    """Resource limits of a single processing stage."""
+
+    nice: int  # extra niceness of the child processes
+    ionice: 'IONiceClass'  # of the child processes
+    max_workers: int
+    max_load: float  # load average per CPU to defer the stage above
+    idle_load: float  # load average per CPU to ignore the budget below
+    budget: float  # seconds of wall time per pass when not idle, 0 = inf
+    mem_per_worker_mb: int
+    tmp_per_worker_mb: int
+
+
+_STAGE_DEFAULTS: StageConfig = {
+    'nice': 0,
+    'ionice': 'none',
+    'max_workers': 1,
+    'max_load': float('inf'),
+    'idle_load': 0.0,
+    'budget': 0,
+    'mem_per_worker_mb': 0,
+    'tmp_per_worker_mb': 0,
+}
+
+
 class DeviceConfig(typing.TypedDict):
     """Type definition for a device section of a config."""
 
     glob: str
     prefer_channel: typing.Literal['left', 'no_preference', 'right']
-    drive: dict[str, str | bool]
+    # exactly one of the two, selects the backend
+    drive: typing.NotRequired[dict[str, str | bool]]  # UDisks2
+    directory: typing.NotRequired[str]  # a plain directory
 
 
-def validate(config: Config) -> Config:
-    """Validate the config a bit (with asserts, but whatever)."""
-    assert config
-    assert set(config.keys()) == {'storage', 'devices'}
-    assert config['storage']
-    assert config['storage']['raw']
-    assert config['devices']
-    for device_config in config['devices'].values():
+def _validate_devices(devices_config: dict[str, DeviceConfig]) -> None:
+    assert devices_config
+    for device_config in devices_config.values():
         assert 'glob' in device_config
         assert '*' in device_config['glob'] or '?' in device_config['glob']
         prefer_channel = device_config.get('prefer_channel', 'no_preference')
         assert prefer_channel in {'left', 'no_preference', 'right'}
         device_config['prefer_channel'] = prefer_channel
-        assert 'drive' in device_config
-        assert device_config['drive']
+        assert ('drive' in device_config) != ('directory' in device_config)
+        if 'drive' in device_config:
+            assert device_config['drive']
+        else:
+            assert device_config['directory']
+
+
+def _validate_policy(policy_config: PolicyConfig) -> PolicyConfig:
+    policy_config.setdefault('export', 'everything')
+    policy_config.setdefault('improve', 'everything')
+    assert set(policy_config.keys()) == {'export', 'improve'}
+    assert policy_config['export'] in POLICIES
+    assert policy_config['improve'] in POLICIES
+    return policy_config
+
+
+def _validate_governor(governor_config: GovernorConfig) -> GovernorConfig:
+    governor_config.setdefault('nice', 0)
+    governor_config.setdefault('ionice', 'none')
+    assert governor_config['ionice'] in IONICE_CLASSES
+    stages_config = governor_config.setdefault('stages', {})
+    assert set(stages_config.keys()) <= set(STAGES)
+    for stage in STAGES:
+        stage_config = stages_config.get(stage, _STAGE_DEFAULTS)
+        assert set(stage_config.keys()) <= set(_STAGE_DEFAULTS.keys())
+        if stage == 'import' and stage in stages_config:
+            # can't be deferred, it happens when a device is plugged in
+            assert (
+                not {'max_load', 'idle_load', 'budget'} & stage_config.keys()
+            )
+        stages_config[stage] = {**_STAGE_DEFAULTS, **stage_config}
+        assert stages_config[stage]['ionice'] in IONICE_CLASSES
+        assert stages_config[stage]['max_workers'] >= 1
+    return governor_config
+
+
+def _validate_flac(flac_config: FlacConfig) -> FlacConfig:
+    flac_config.setdefault('segment_len', 0)
+    assert set(flac_config.keys()) == {'segment_len'}
+    assert flac_config['segment_len'] >= 0
+    return flac_config
+
+
+def _validate_improve(improve_config: ImproveConfig) -> ImproveConfig:
+    improve_config.setdefault('vad', False)
+    improve_config.setdefault('attenuation_db', 20)
+    improve_config.setdefault('unvoiced_attenuation_db', 20)
+    assert set(improve_config.keys()) == {
+        'vad',
+        'attenuation_db',
+        'unvoiced_attenuation_db',
+    }
+    assert improve_config['attenuation_db'] >= 0
+    assert improve_config['unvoiced_attenuation_db'] >= 0
+    return improve_config
+
+
+def _validate_cache(cache_config: CacheConfig) -> CacheConfig:
+    assert cache_config['dir']
+    cache_config.setdefault('max_size_mb', 0)
+    cache_config.setdefault('rate', 48000)
+    assert set(cache_config.keys()) == {'dir', 'max_size_mb', 'rate'}
+    return cache_config
+
+
+def validate(config: Config) -> Config:
+    """Validate the config a bit (with asserts, but whatever)."""
+    assert config
+    assert set(config.keys()) <= {
+        'storage',
+        'devices',
+        'policy',
+        'governor',
+        'flac',
+        'cache',
+        'improve',
+    }
+    assert config['storage']
+    assert config['storage']['raw']
+    _validate_devices(config['devices'])
+    config['policy'] = _validate_policy(config.get('policy', {}))
+    config['governor'] = _validate_governor(config.get('governor', {}))
+    config['flac'] = _validate_flac(config.get('flac', {}))
+    config['improve'] = _validate_improve(config.get('improve', {}))
+    if 'cache' in config:
+        config['cache'] = _validate_cache(config['cache'])
     return config
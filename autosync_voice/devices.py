@@ -3,6 +3,7 @@
 
 """Working with storage devices."""
 
+import abc
 import contextlib
 import tomllib
 import typing
@@ -31,15 +32,55 @@ def _udisks() -> dasbus.client.proxy.InterfaceProxy:
         bus.disconnect()
 
 
-class Device:
-    """Represents a USB storage device to import the recordings from."""
+class Device(abc.ABC):
+    """Represents a storage device to import the recordings from."""
 
     name: str
-    drive: str
     time: int
 
+    def __init__(self, name: str, time: int) -> None:  # noqa: D107
+        self.name, self.time = name, time
+
+    @abc.abstractmethod
+    def mount(self) -> Path:
+        """Make the device contents available somewhere."""
+
+    @abc.abstractmethod
+    def umount(self) -> None:
+        """Make the device safe to remove."""
+
+    def check_mount(self) -> Path:
+        """Mount and double-check this is the right device."""
+        mountpoint = self.mount()
+        ondev = tomllib.loads((mountpoint / 'autosync-voice.toml').read_text())
+        assert ondev.get('device_name') == self.name
+        click.echo(
+            f'{self.name} has a matching `{mountpoint}/autosync-voice.toml`',
+        )
+        return mountpoint
+
+    def mark_imported(self, config: Config) -> None:
+        """Remember the plugged-in time of the device."""
+        timestamp_path = Path(config['storage']['meta'], 'imported', self.name)
+        timestamp_path.parent.mkdir(parents=True, exist_ok=True)
+        timestamp_path.write_text(str(self.time))
+
+    def is_imported(self, config: Config) -> bool:
+        """Compare the plugged-in time with the last known one."""
+        timestamp_path = Path(config['storage']['meta'], 'imported', self.name)
+        if not timestamp_path.exists():
+            return False
+        return int(timestamp_path.read_text()) >= self.time
+
+
+class UDisksDevice(Device):
+    """Represents a USB storage device, managed through UDisks2."""
+
+    drive: str
+
     def __init__(self, name: str, drive: str, time: int) -> None:  # noqa: D107
-        self.name, self.drive, self.time = name, drive, time
+        super().__init__(name, time)
+        self.drive = drive
 
     def mount(self) -> Path:
         """Mount the right device somewhere."""
@@ -68,16 +109,6 @@ class Device:
             click.echo(f'{self.name} mounted at `{mountpoint}`')
             return mountpoint
 
-    def check_mount(self) -> Path:
-        """Mount and double-check this is the right device."""
-        mountpoint = self.mount()
-        ondev = tomllib.loads((mountpoint / 'autosync-voice.toml').read_text())
-        assert ondev.get('device_name') == self.name
-        click.echo(
-            f'{self.name} has a matching `{mountpoint}/autosync-voice.toml`',
-        )
-        return mountpoint
-
     def umount(self) -> None:
         """Unmount the device."""
         log = structlog.get_logger()
@@ -137,33 +168,45 @@ class Device:
                 msg = 'multiple mountpoints detected'
                 raise NotImplementedError(msg)
 
-    def mark_imported(self, config: Config) -> None:
-        """Remember the plugged-in time of the device."""
-        timestamp_path = Path(config['storage']['meta'], 'imported', self.name)
-        timestamp_path.parent.mkdir(parents=True, exist_ok=True)
-        timestamp_path.write_text(str(self.time))
 
-    def is_imported(self, config: Config) -> bool:
-        """Compare the plugged-in time with the last known one."""
-        timestamp_path = Path(config['storage']['meta'], 'imported', self.name)
-        if not timestamp_path.exists():
-            return False
-        return int(timestamp_path.read_text()) >= self.time
+class DirectoryDevice(Device):
+    """Represents a plain directory, e.g., an already mounted share."""
 
+    path: Path
 
-def detect_devices(config: Config) -> tuple[Device, ...]:
-    """Find all drives/partitions matching the devices from config."""
+    def __init__(self, name: str, path: Path, time: int) -> None:  # noqa: D107
+        super().__init__(name, time)
+        self.path = path
+
+    def mount(self) -> Path:
+        """Nothing to mount, it's already there."""
+        click.echo(f'{self.name} is a directory at `{self.path}`')
+        return self.path
+
+    def umount(self) -> None:
+        """Nothing to unmount."""
+
+
+def _detect_udisks(config: Config) -> list[Device]:
+    """Find all drives/partitions matching the UDisks devices from config."""
     log = structlog.get_logger()
+    devices_config = {
+        device: device_config
+        for device, device_config in config['devices'].items()
+        if 'drive' in device_config
+    }
+    if not devices_config:
+        return []  # don't even talk to UDisks then
     with _udisks() as (_, udisks):
         devtree = udisks.GetManagedObjects().items()
     # find interesting Drives, gather Devices
     log.debug('scanning devices')
-    devices = []
+    devices: list[Device] = []
     for drive, iface_dict in devtree:
         if 'org.freedesktop.UDisks2.Drive' not in iface_dict:
             continue
         device_attrs = iface_dict['org.freedesktop.UDisks2.Drive']
-        for device, device_config in config['devices'].items():
+        for device, device_config in devices_config.items():
             log.debug('matching', drive=drive, against=device)
             match_criteria = device_config['drive']
             for k, v in match_criteria.items():
@@ -173,6 +216,39 @@ def detect_devices(config: Config) -> tuple[Device, ...]:
             else:
                 time = device_attrs['TimeMediaDetected'].unpack()
                 log.debug('found', device=device, drive=drive)
-                devices.append(Device(name=device, drive=drive, time=time))
+                devices.append(UDisksDevice(device, drive=drive, time=time))
                 break
-    return tuple(devices)
+    return devices
+
+
+def _detect_directories(config: Config) -> list[Device]:
+    """Find all existing directories from config.
+
+    The newest change time of the files to import (in microseconds,
+    like UDisks' TimeMediaDetected) stands in for the plugged-in time,
+    so that a directory gets reimported whenever new files appear there.
+    """
+    log = structlog.get_logger()
+    devices: list[Device] = []
+    for device, device_config in config['devices'].items():
+        if 'directory' not in device_config:
+            continue
+        path = Path(device_config['directory'])
+        if not path.is_dir():
+            log.debug('no directory', device=device, path=path)
+            continue
+        time = max(
+            (
+                f.stat().st_ctime_ns // 1000
+                for f in path.glob(device_config['glob'])
+            ),
+            default=0,
+        )
+        log.debug('found', device=device, path=path, time=time)
+        devices.append(DirectoryDevice(device, path=path, time=time))
+    return devices
+
+
+def detect_devices(config: Config) -> tuple[Device, ...]:
+    """Find all devices from config that are present."""
+    return (*_detect_directories(config), *_detect_udisks(config))
@@ -6,15 +6,34 @@
 
 """Export a file, just transcoding it to opus."""
 
+import contextlib
+import typing
 from pathlib import Path
 
 import ffmpeg  # type: ignore[import-untyped]
 
+import autosync_voice.pcm_cache
 
-def export(out: Path, inp: Path) -> None:
-    """Export a file, just transcoding it to opus."""
+
+def export(
+    out: Path,
+    inp: Path,
+    *,
+    cmd_prefix: typing.Sequence[str] = (),
+    cache: autosync_voice.pcm_cache.PCMCache | None = None,
+) -> None:
+    """Export a file, just transcoding it to opus.
+
+    The input is taken from the PCM cache if there is one.
+    """
     out.parent.mkdir(parents=True, exist_ok=True)
-    stream = ffmpeg.input(inp)
     tmp = out.with_suffix('.tmp.opus')
-    stream.output(str(tmp), loglevel='quiet').overwrite_output().run()
+    with (
+        cache.pcm(inp, cmd_prefix=cmd_prefix)
+        if cache
+        else contextlib.nullcontext(inp)
+    ) as src:
+        stream = ffmpeg.input(str(src))
+        stream = stream.output(str(tmp), loglevel='quiet').overwrite_output()
+        stream.run(cmd=[*cmd_prefix, 'ffmpeg'])
     tmp.rename(out)
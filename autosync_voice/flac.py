@@ -0,0 +1,502 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""Encoding FLAC, long recordings in parallel segments.
+
+A long recording is cut at sample-exact boundaries that are multiples of
+the block size, the segments are encoded in parallel and then stitched
+into a single stream: frames get renumbered and their CRCs patched,
+STREAMINFO gets the totals and the MD5 of the whole recording.
+The result is then decoded and checked against the source,
+falling back to a serial encode should anything be off.
+"""
+
+import concurrent.futures
+import hashlib
+import math
+import tempfile
+import typing
+from pathlib import Path
+
+import ffmpeg  # type: ignore[import-untyped]
+import structlog
+
+BLOCK_SIZE = 4608  # what ffmpeg picks for 44.1 and 48 kHz anyway
+SEEKPOINT_INTERVAL = 10  # seconds, like flac does by default
+_RAW_FORMATS = {8: 's8', 16: 's16le', 24: 's24le'}  # what MD5 is over
+
+
+def _crc_table(poly: int, width: int) -> tuple[int, ...]:
+    top, mask = 1 << (width - 1), (1 << width) - 1
+    table = []
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for _ in range(8):
+            crc = (crc << 1) ^ poly if crc & top else crc << 1
+        table.append(crc & mask)
+    return tuple(table)
+
+
+_CRC8_TABLE = _crc_table(0x07, 8)
+_CRC16_TABLE = _crc_table(0x8005, 16)
+
+
+def crc8(data: bytes) -> int:
+    """Calculate CRC-8 the way FLAC frame headers have it.
+
+    >>> hex(crc8(b'123456789'))
+    '0xf4'
+    """
+    crc = 0
+    for b in data:
+        crc = _CRC8_TABLE[crc ^ b]
+    return crc
+
+
+def crc16(data: bytes, crc: int = 0) -> int:
+    """Calculate CRC-16 the way FLAC frames have it.
+
+    >>> hex(crc16(b'123456789'))
+    '0xfee8'
+    """
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC16_TABLE[(crc >> 8) ^ b]
+    return crc
+
+
+def _crc16_zeros_tables(
+    bits: int,
+) -> tuple[tuple[tuple[int, ...], tuple[int, ...]], ...]:
+    # CRC-16 of zeroes is linear in the initial value,
+    # so advancing it by 2**k zero bytes is two lookups, by low and high byte
+    lo = tuple(crc16(b'\0', v) for v in range(256))
+    hi = tuple(crc16(b'\0', v << 8) for v in range(256))
+    tables = []
+    for _ in range(bits):
+        tables.append((lo, hi))
+        lo, hi = (
+            tuple(
+                lo[w & 0xFF] ^ hi[w >> 8] for w in (lo[v] for v in range(256))
+            ),
+            tuple(
+                lo[w & 0xFF] ^ hi[w >> 8] for w in (hi[v] for v in range(256))
+            ),
+        )
+    return tuple(tables)
+
+
+_CRC16_ZEROS_TABLES = _crc16_zeros_tables(24)  # frames are under 16 MiB
+
+
+def crc16_zeros(crc: int, n: int) -> int:
+    """Advance CRC-16 over n zero bytes in O(log n).
+
+    >>> crc16_zeros(crc16(b'123'), 1000) == crc16(b'123' + bytes(1000))
+    True
+    """
+    for lo, hi in _CRC16_ZEROS_TABLES:
+        if not n:
+            break
+        if n & 1:
+            crc = lo[crc & 0xFF] ^ hi[crc >> 8]
+        n >>= 1
+    assert not n
+    return crc
+
+
+def encode_number(n: int) -> bytes:
+    """Encode a frame number in the UTF-8-like way of FLAC frame headers.
+
+    >>> encode_number(5).hex(), encode_number(0x80).hex()
+    ('05', 'c280')
+    """
+    if n < 0x80:  # noqa: PLR2004
+        return bytes((n,))
+    length = 2
+    while n >= 1 << (5 * length + 1):
+        length += 1
+    assert length <= 7  # noqa: PLR2004
+    first = ((0xFF00 >> length) & 0xFF) | (n >> (6 * (length - 1)))
+    rest = (0x80 | ((n >> (6 * i)) & 0x3F) for i in range(length - 2, -1, -1))
+    return bytes((first, *rest))
+
+
+def decode_number(data: bytes, pos: int = 0) -> tuple[int, int] | None:
+    """Decode a frame number, return it with its length, None if invalid.
+
+    >>> decode_number(encode_number(2**35 + 1)) == (2**35 + 1, 7)
+    True
+    """
+    if pos >= len(data):
+        return None
+    first = data[pos]
+    if first < 0x80:  # noqa: PLR2004
+        return first, 1
+    length = 8 - (~first & 0xFF).bit_length()
+    if not 2 <= length <= 7 or pos + length > len(data):  # noqa: PLR2004
+        return None
+    n = first & (0x7F >> length)
+    for b in data[pos + 1 : pos + length]:
+        if b & 0xC0 != 0x80:  # noqa: PLR2004
+            return None
+        n = n << 6 | b & 0x3F
+    return n, length
+
+
+def _parse_frame_header(data: bytes, pos: int) -> tuple[int, int, int] | None:
+    """Parse a fixed-blocksize frame header at pos.
+
+    Returns frame number, its encoded length and the header length,
+    or None if there's no valid frame header there.
+    """
+    if data[pos : pos + 2] != b'\xff\xf8' or pos + 4 >= len(data):
+        return None
+    bs_code, sr_code = data[pos + 2] >> 4, data[pos + 2] & 0xF
+    if bs_code == 0 or sr_code == 0xF or data[pos + 3] & 1:  # noqa: PLR2004
+        return None
+    if (number := decode_number(data, pos + 4)) is None:
+        return None
+    n, n_len = number
+    hlen = 4 + n_len + {6: 1, 7: 2}.get(bs_code, 0)
+    hlen += {12: 1, 13: 2, 14: 2}.get(sr_code, 0) + 1  # + CRC-8
+    if pos + hlen > len(data):
+        return None
+    if crc8(data[pos : pos + hlen - 1]) != data[pos + hlen - 1]:
+        return None
+    return n, n_len, hlen
+
+
+def _metadata_end(data: bytes) -> int:
+    if data[:4] != b'fLaC':
+        msg = 'not a FLAC stream'
+        raise ValueError(msg)
+    pos, last = 4, False
+    while not last:
+        last = bool(data[pos] & 0x80)
+        pos += 4 + int.from_bytes(data[pos + 1 : pos + 4])
+    return pos
+
+
+def _frame_offsets(data: bytes) -> list[int]:
+    """Find the offsets of all the frames of an ffmpeg-encoded FLAC.
+
+    Raises:
+        ValueError: if the first frame isn't right after the metadata.
+
+    """
+    pos = _metadata_end(data)
+    header = _parse_frame_header(data, pos)
+    if header is None or header[0] != 0:
+        msg = 'no first frame after the metadata'
+        raise ValueError(msg)
+    # only frames with matching sample rate/bps codes and next number
+    # are even considered, the stitched result is verified anyway;
+    # channel assignment is not compared, as it's chosen per frame
+    signature = data[pos + 2] & 0xF, data[pos + 3] & 0x0E
+    offsets = [pos]
+    while True:
+        pos = data.find(b'\xff\xf8', pos + header[2])
+        while pos != -1:
+            h = _parse_frame_header(data, pos)
+            if (
+                h is not None
+                and h[0] == len(offsets)
+                and (data[pos + 2] & 0xF, data[pos + 3] & 0x0E) == signature
+            ):
+                header = h
+                break
+            pos = data.find(b'\xff\xf8', pos + 1)
+        if pos == -1:
+            return offsets
+        offsets.append(pos)
+
+
+def _renumber_frame(frame: bytes, n: int) -> bytes:
+    """Set the number of a fixed-blocksize frame, patching both CRCs."""
+    header = _parse_frame_header(frame, 0)
+    assert header is not None
+    _, n_len, hlen = header
+    old_header = frame[: hlen - 1]
+    new_header = old_header[:4] + encode_number(n) + old_header[4 + n_len :]
+    new_header += bytes((crc8(new_header),))
+    # CRC-16 is linear: only the difference in headers needs to be carried
+    # through the rest of the frame (CRC-16 itself excluded)
+    body_len = len(frame) - hlen - 2
+    diff = crc16(old_header + frame[hlen - 1 : hlen]) ^ crc16(new_header)
+    old_crc = int.from_bytes(frame[-2:])
+    new_crc = old_crc ^ crc16_zeros(diff, body_len)
+    return new_header + frame[hlen:-2] + new_crc.to_bytes(2)
+
+
+def _streaminfo(data: bytes) -> tuple[int, int, int, int]:
+    """Parse sample rate, channels, bits per sample and total samples.
+
+    Raises:
+        ValueError: if there's no STREAMINFO where it's expected.
+
+    """
+    if data[:4] != b'fLaC' or data[4] & 0x7F != 0:  # STREAMINFO goes first
+        msg = 'no STREAMINFO'
+        raise ValueError(msg)
+    x = int.from_bytes(data[18:26])
+    return x >> 44, (x >> 41 & 0x7) + 1, (x >> 36 & 0x1F) + 1, x & (2**36 - 1)
+
+
+def _seektable(
+    total: int,
+    rate: int,
+    frame_offsets: dict[int, int],
+) -> bytes:
+    """Build a SEEKTABLE block body with a point every SEEKPOINT_INTERVAL.
+
+    Points with their frame offset unknown are left as placeholders.
+    """
+    points = []
+    for sample in range(0, total, SEEKPOINT_INTERVAL * rate):
+        n = sample // BLOCK_SIZE
+        if n in frame_offsets:
+            frame_sample = n * BLOCK_SIZE
+            points.append(
+                frame_sample.to_bytes(8)
+                + frame_offsets[n].to_bytes(8)
+                + min(BLOCK_SIZE, total - frame_sample).to_bytes(2),
+            )
+        else:
+            points.append(b'\xff' * 8 + bytes(10))
+    return b''.join(points)
+
+
+def _metadata(first: bytes, seektable: bytes) -> tuple[bytes, int]:
+    """Copy the metadata of the first segment, replacing its SEEKTABLE.
+
+    The SEEKTABLE goes right after STREAMINFO, its offset is returned too.
+    """
+    blocks, pos = [], 4
+    meta_end = _metadata_end(first)
+    while pos < meta_end:
+        blen = 4 + int.from_bytes(first[pos + 1 : pos + 4])
+        if first[pos] & 0x7F != 3:  # noqa: PLR2004
+            blocks.append(bytearray(first[pos : pos + blen]))
+        pos += blen
+    blocks.insert(1, bytearray(b'\x03' + len(seektable).to_bytes(3)))
+    blocks[1] += seektable
+    for block in blocks:
+        block[0] &= 0x7F
+    blocks[-1][0] |= 0x80
+    return b'fLaC' + b''.join(blocks), 4 + len(blocks[0]) + 4
+
+
+def stitch(  # noqa: PLR0914
+    out: Path,
+    segments: typing.Sequence[Path],
+    md5: bytes,
+) -> None:
+    """Stitch FLAC segments of BLOCK_SIZE-multiple lengths into one.
+
+    The SEEKTABLE is rebuilt for the whole stream.
+
+    Raises:
+        ValueError: if the segments don't fit together.
+
+    """
+    first = segments[0].read_bytes()
+    rate, channels, bps, _ = _streaminfo(first)
+    totals = []
+    for segment in segments:
+        with segment.open('rb') as f:
+            totals.append(_streaminfo(f.read(42))[3])
+    # the frames of the seekpoints, their offsets are filled in on writing
+    seek_frames = {
+        sample // BLOCK_SIZE: 0
+        for sample in range(0, sum(totals), SEEKPOINT_INTERVAL * rate)
+    }
+    seektable = _seektable(sum(totals), rate, {})  # placeholders for now
+    metadata, seektable_pos = _metadata(first, seektable)
+
+    total, min_fs, max_fs = 0, 2**24 - 1, 0
+    with out.open('wb') as f:
+        f.write(metadata)
+        frames_start = f.tell()
+        for i, segment in enumerate(segments):
+            data = first if not i else segment.read_bytes()
+            *seg_format, seg_total = _streaminfo(data)
+            if tuple(seg_format) != (rate, channels, bps):
+                msg = f'segment {i} format {seg_format} differs'
+                raise ValueError(msg)
+            if i != len(segments) - 1 and seg_total % BLOCK_SIZE:
+                msg = f'segment {i} length {seg_total} is not block-aligned'
+                raise ValueError(msg)
+            offsets = _frame_offsets(data)
+            if len(offsets) != math.ceil(seg_total / BLOCK_SIZE):
+                msg = f'segment {i} has {len(offsets)} frames found'
+                raise ValueError(msg)
+            for j, (beg, end) in enumerate(
+                zip(offsets, [*offsets[1:], len(data)], strict=True),
+            ):
+                n = total // BLOCK_SIZE + j
+                if n in seek_frames:
+                    seek_frames[n] = f.tell() - frames_start
+                frame = _renumber_frame(data[beg:end], n)
+                min_fs, max_fs = (
+                    min(min_fs, len(frame)),
+                    max(max_fs, len(frame)),
+                )
+                f.write(frame)
+            total += seg_total
+        # patch STREAMINFO: frame sizes, total samples and MD5
+        f.seek(8 + 4)
+        f.write(min_fs.to_bytes(3) + max_fs.to_bytes(3))
+        f.seek(8 + 10)
+        x = rate << 44 | (channels - 1) << 41 | (bps - 1) << 36 | total
+        f.write(x.to_bytes(8) + md5)
+        f.seek(seektable_pos)
+        f.write(_seektable(total, rate, seek_frames))
+
+
+def raw_md5(
+    inp: Path,
+    bps: int,
+    cmd_prefix: typing.Sequence[str] = (),
+) -> tuple[bytes, int]:
+    """Decode a file, return MD5 of the samples the FLAC way and their count.
+
+    The count is in samples per channel times channels.
+    """
+    stream = ffmpeg.input(str(inp)).output(
+        'pipe:',
+        format=_RAW_FORMATS[bps],
+        loglevel='quiet',
+    )
+    proc = stream.run_async(cmd=[*cmd_prefix, 'ffmpeg'], pipe_stdout=True)
+    md5, size = hashlib.md5(), 0  # noqa: S324
+    while chunk := proc.stdout.read(2**20):
+        md5.update(chunk)
+        size += len(chunk)
+    assert proc.wait() == 0
+    return md5.digest(), size // (bps // 8)
+
+
+def _encode_serial(
+    out: Path,
+    inp: Path,
+    compression_level: int,
+    cmd_prefix: typing.Sequence[str],
+    seek: int = 0,  # seconds to skip on the input side
+    **kwargs: typing.Any,  # noqa: ANN401
+) -> None:
+    stream = ffmpeg.input(str(inp), **({'ss': seek} if seek else {}))
+    stream = stream.output(
+        str(out),
+        compression_level=compression_level,
+        loglevel='quiet',
+        **kwargs,
+    )
+    stream.overwrite_output().run(cmd=[*cmd_prefix, 'ffmpeg'])
+
+
+def _encode_segmented(  # noqa: PLR0913, PLR0917
+    out: Path,
+    inp: Path,
+    rate: int,
+    bounds: typing.Sequence[tuple[int, int]],
+    workers: int,
+    compression_level: int,
+    cmd_prefix: typing.Sequence[str],
+) -> bool:
+    log = structlog.get_logger()
+    with tempfile.TemporaryDirectory() as tempdir:
+        segments = [Path(tempdir) / f'{i}.flac' for i in range(len(bounds))]
+        # seek on the input side to a whole second (so, a whole sample)
+        # a bit before the segment, only trimming the rest sample-exactly
+        seeks = [max(0, beg // rate - 1) for beg, _ in bounds]
+        with concurrent.futures.ThreadPoolExecutor(workers) as ex:
+            futures = [
+                ex.submit(
+                    _encode_serial,
+                    segment,
+                    inp,
+                    compression_level,
+                    cmd_prefix,
+                    seek,
+                    af=(
+                        f'atrim=start_sample={beg - seek * rate}'
+                        f':end_sample={end - seek * rate}'
+                    ),
+                    frame_size=BLOCK_SIZE,
+                )
+                for segment, seek, (beg, end) in zip(
+                    segments,
+                    seeks,
+                    bounds,
+                    strict=True,
+                )
+            ]
+            for future in futures:
+                future.result()
+        try:
+            _, channels, bps, _ = _streaminfo(segments[0].read_bytes())
+        except ValueError as ex:
+            log.warning('unexpected segment', error=str(ex))
+            return False
+        if bps not in _RAW_FORMATS:
+            log.warning('unsupported bits per sample', bps=bps)
+            return False
+        md5, samples = raw_md5(inp, bps, cmd_prefix)
+        if samples != bounds[-1][1] * channels:
+            log.warning('unexpected length', samples=samples, bounds=bounds)
+            return False
+        try:
+            stitch(out, segments, md5)
+        except ValueError as ex:
+            log.warning('stitching failed', error=str(ex))
+            return False
+    with out.open('rb') as f:
+        *_, total = _streaminfo(f.read(64))
+    out_md5, out_samples = raw_md5(out, bps, cmd_prefix)
+    log.debug('stitched', total=total, md5=md5.hex(), out_md5=out_md5.hex())
+    if total * channels != samples or out_samples != samples or out_md5 != md5:
+        log.warning('stitching failed verification', inp=inp, out=out)
+        return False
+    return True
+
+
+def encode(  # noqa: PLR0913
+    out: Path,
+    inp: Path,
+    *,
+    compression_level: int = 12,
+    segment_len: float = 0,
+    workers: int = 1,
+    cmd_prefix: typing.Sequence[str] = (),
+) -> None:
+    """Encode a file to FLAC, in segments of segment_len seconds if it's long.
+
+    Segmenting is disabled with segment_len of 0 or just one worker.
+    """
+    log = structlog.get_logger()
+    if segment_len and workers > 1:
+        stream = ffmpeg.probe(inp)['streams'][0]
+        rate, length = int(stream['sample_rate']), stream.get('duration_ts')
+        seg = int(segment_len * rate) // BLOCK_SIZE * BLOCK_SIZE
+        if stream.get('time_base') != f'1/{rate}' or length is None:
+            # duration_ts isn't in samples, can't cut sample-exactly by it
+            log.warning(
+                'unexpected time base, not segmenting',
+                inp=inp,
+                time_base=stream.get('time_base'),
+            )
+        elif seg and (length := int(length)) > seg:
+            bounds = [(b, min(b + seg, length)) for b in range(0, length, seg)]
+            log.debug('encoding segmented', inp=inp, segments=len(bounds))
+            if _encode_segmented(
+                out,
+                inp,
+                rate,
+                bounds,
+                workers,
+                compression_level,
+                cmd_prefix,
+            ):
+                return
+            log.warning('falling back to serial encoding', inp=inp)
+    _encode_serial(out, inp, compression_level, cmd_prefix)
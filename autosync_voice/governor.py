@@ -0,0 +1,147 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""Keeping background processing from getting in the way of the user.
+
+Stages are run with configurable nice/ionice classes,
+with as many jobs at once as load average, free memory and free temp space
+allow, deferring the stage altogether if the machine is too busy for it
+and limiting its wall time per pass unless the machine is idle.
+"""
+
+import concurrent.futures
+import os
+import shutil
+import subprocess  # noqa: S404
+import tempfile
+import time
+import typing
+from pathlib import Path
+
+import structlog
+
+if typing.TYPE_CHECKING:
+    from autosync_voice.config import GovernorConfig, StageConfig
+
+Stage = typing.Literal['import', 'sync', 'export', 'improve']
+STAGES: tuple[Stage, ...] = typing.get_args(Stage)
+IONiceClass = typing.Literal['none', 'best-effort', 'idle']
+IONICE_CLASSES: tuple[IONiceClass, ...] = typing.get_args(IONiceClass)
+
+_IONICE_ARGS: dict[IONiceClass, tuple[str, ...]] = {
+    'none': (),
+    'best-effort': ('ionice', '-c', '2'),
+    'idle': ('ionice', '-c', '3'),
+}
+_MB = 1024 * 1024
+
+
+def apply_to_process(gconfig: 'GovernorConfig') -> None:
+    """Increase the niceness and set the I/O class of this very process.
+
+    The niceness is increased relative to the current one,
+    so that starting it with `nice` or `Nice=` still works.
+    Everything spawned later inherits them.
+    """
+    log = structlog.get_logger()
+    if gconfig['nice']:
+        nice = os.nice(gconfig['nice'])
+        log.debug('reniced', nice=nice)
+    if ionice := _IONICE_ARGS[gconfig['ionice']]:
+        subprocess.run([*ionice, '-p', str(os.getpid())], check=True)  # noqa: S603
+        log.debug('reioniced', ionice=gconfig['ionice'])
+
+
+def cmd_prefix(sconfig: 'StageConfig') -> tuple[str, ...]:
+    """Return a prefix to run the child processes of a stage with."""
+    nice = ('nice', '-n', str(sconfig['nice'])) if sconfig['nice'] else ()
+    return (*nice, *_IONICE_ARGS[sconfig['ionice']])
+
+
+def _load_per_cpu(running: int = 0) -> float:
+    # not counting the jobs of the stage itself, they'd defer it otherwise
+    return max(0, os.getloadavg()[0] - running) / (os.cpu_count() or 1)
+
+
+def _mem_available() -> int | None:
+    try:
+        meminfo = Path('/proc/meminfo').read_text()
+    except FileNotFoundError:
+        return None
+    for line in meminfo.splitlines():
+        if line.startswith('MemAvailable:'):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+def workers(sconfig: 'StageConfig', running: int = 0) -> int:
+    """Decide how many jobs of a stage can be run at once, 0 to defer it.
+
+    The load, memory and temp space taken by the jobs already running
+    are not held against the stage.
+    """
+    log = structlog.get_logger()
+    if (load_per_cpu := _load_per_cpu(running)) > sconfig['max_load']:
+        log.debug('too loaded', load_per_cpu=load_per_cpu)
+        return 0
+    cpus = os.cpu_count() or 1
+    limits = {
+        'max_workers': sconfig['max_workers'],
+        'cpu': max(1, cpus - int(load_per_cpu * cpus)),
+    }
+    mem_per_worker = sconfig['mem_per_worker_mb'] * _MB
+    if mem_per_worker and (mem := _mem_available()) is not None:
+        limits['mem'] = running + mem // mem_per_worker
+    if tmp_per_worker := sconfig['tmp_per_worker_mb'] * _MB:
+        tmp = shutil.disk_usage(tempfile.gettempdir()).free
+        limits['tmp'] = running + tmp // tmp_per_worker
+    log.debug('worker limits', **limits)
+    return min(limits.values())
+
+
+def run(
+    sconfig: 'StageConfig',
+    stage: Stage,
+    jobs: typing.Iterable[typing.Callable[[], None]],
+) -> None:
+    """Run jobs of a stage, as many at once as the machine allows.
+
+    The number of workers is re-evaluated before starting every job.
+    When the machine is not idle, no new jobs are started
+    once the stage's budget (in seconds, 0 for unlimited) is exhausted.
+    Whatever's not started is left for the next pass.
+    """
+    log = structlog.get_logger()
+    start = time.monotonic()
+    jobs_iter = iter(jobs)
+    running: set[concurrent.futures.Future[None]] = set()
+    with concurrent.futures.ThreadPoolExecutor(sconfig['max_workers']) as ex:
+        while True:
+            if running:  # reap the finished ones, reraising exceptions
+                done = {f for f in running if f.done()}
+                for f in done:
+                    f.result()
+                running -= done
+            elapsed = time.monotonic() - start
+            if (
+                sconfig['budget']
+                and elapsed > sconfig['budget']
+                and _load_per_cpu(len(running)) > sconfig['idle_load']
+            ):
+                log.info('out of budget', stage=stage, elapsed=elapsed)
+                break
+            if len(running) >= workers(sconfig, len(running)):
+                if not running:
+                    log.info('deferring', stage=stage)
+                    break
+                concurrent.futures.wait(
+                    running,
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                continue
+            job = next(jobs_iter, None)
+            if job is None:
+                break
+            running.add(ex.submit(job))
+    for f in running:  # the executor has waited for them already
+        f.result()
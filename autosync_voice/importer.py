@@ -5,12 +5,15 @@
 
 import datetime
 import re
+import typing
 from pathlib import Path
 
 import click
 import ffmpeg  # type: ignore[import-untyped]
 import structlog
 
+import autosync_voice.flac
+
 
 def rename(name: str) -> tuple[str, str]:
     """Split the name into year and time."""
@@ -38,14 +41,24 @@ def rename(name: str) -> tuple[str, str]:
     return today, f'unknown-{name}'
 
 
-def import_files(
+def import_files(  # noqa: PLR0913
     dev_dir: Path,
     dev_name: str,
     glob: str,
     raw_dir: Path,
-) -> None:
-    """Import files into raw storage, transcoding to FLAC."""
+    *,
+    segment_len: float = 0,
+    workers: int = 1,
+    cmd_prefix: typing.Sequence[str] = (),
+) -> float:
+    """Import files into raw storage, transcoding to FLAC.
+
+    Long files are encoded in segments of segment_len seconds,
+    by as many workers at once.
+    Returns the total duration of the imported audio in seconds.
+    """
     log = structlog.get_logger()
+    total_duration = 0.0
     log.debug('import_files', dev_dir=dev_dir, glob=glob, raw_dir=raw_dir)
     for f in dev_dir.glob(glob):
         log.debug('importing', file=f)
@@ -65,14 +78,14 @@ def import_files(
         # Transcode to tmp path
         out_path.parent.mkdir(parents=True, exist_ok=True)
         out_tmp_path.unlink(missing_ok=True)
-        stream = ffmpeg.input(f)
-        stream = ffmpeg.output(
-            stream,
-            str(out_tmp_path),
+        autosync_voice.flac.encode(
+            out_tmp_path,
+            f,
             compression_level=12,
-            loglevel='quiet',
+            segment_len=segment_len,
+            workers=workers,
+            cmd_prefix=cmd_prefix,
         )
-        ffmpeg.run(stream)
 
         # Check durations
         orig_duration = float(ffmpeg.probe(f)['format']['duration'])
@@ -86,3 +99,5 @@ def import_files(
         # Remove the original
         f.unlink()
         log.debug('imported', file=f, to=out_path)
+        total_duration += orig_duration
+    return total_duration
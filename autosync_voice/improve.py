@@ -7,30 +7,223 @@
 """Calculating the shift between audio files and merging them."""
 
 import shutil
+import struct
 import subprocess  # noqa: S404
 import tempfile
+import typing
 from pathlib import Path
 
+import click
 import ffmpeg  # type: ignore[import-untyped]
+import numpy as np
+import scipy.io  # type: ignore[import-untyped]
+import structlog
 
+import autosync_voice.pcm_cache
+import autosync_voice.vad
 
-def _improve_48k(out: Path, inp: Path, tmp_dir: Path) -> None:
+VAD_WORTH_IT = 0.8  # denoise everything if more than that is voiced
+XFADE = 0.05  # seconds, crossfade between denoised and attenuated regions
+_CHUNK = 2**20  # samples to attenuate at once
+
+
+def _improve_48k(
+    out: Path,
+    inp: Path,
+    tmp_dir: Path,
+    cmd_prefix: typing.Sequence[str],
+    attenuation_db: float,
+) -> None:
     tmp = tmp_dir / 'tmp.wav'
     shutil.copy(inp, tmp)  # it's in-place now for some reason
-    args = ['-o', str(tmp_dir), '--pf', '-D', '-a', '20', str(tmp)]
-    subprocess.run(['deepfilternet', *args], check=True)  # noqa: S603, S607
+    att = str(attenuation_db)
+    args = ['-o', str(tmp_dir), '--pf', '-D', '-a', att, str(tmp)]
+    cmd = [*cmd_prefix, 'deepfilternet', *args]
+    subprocess.run(cmd, check=True)  # noqa: S603
     tmp.rename(out)
 
 
-def improve(out: Path, inp: Path) -> None:
-    """Improve a recording (de-noise, etc)."""
+def _as_float32(
+    data: np.ndarray[typing.Any, np.dtype[typing.Any]],
+) -> np.ndarray[typing.Any, np.dtype[np.float32]]:
+    if np.issubdtype(data.dtype, np.integer):
+        scale = 2 ** (8 * data.dtype.itemsize - 1)
+        return np.asarray(data / scale, dtype=np.float32)
+    return np.asarray(data, dtype=np.float32)
+
+
+def _float32_wav(
+    path: Path,
+    rate: int,
+    shape: tuple[int, ...],
+) -> np.memmap[typing.Any, np.dtype[np.float32]]:
+    """Create a float32 WAV of the given shape, memmapped to write it."""
+    channels = shape[1] if len(shape) > 1 else 1
+    size = shape[0] * channels * 4
+    fmt = struct.pack(
+        '<HHIIHH',
+        3,  # IEEE float
+        channels,
+        rate,
+        rate * channels * 4,
+        channels * 4,
+        32,
+    )
+    cap = 2**32 - 1  # sizes overflowing 32 bits are capped, like ffmpeg does
+    header = struct.pack(
+        '<4sI4s4sI',
+        b'RIFF',
+        min(20 + len(fmt) + size, cap),
+        b'WAVE',
+        b'fmt ',
+        len(fmt),
+    )
+    header += fmt + struct.pack('<4sI', b'data', min(size, cap))
+    with path.open('wb') as f:
+        f.write(header)
+        f.truncate(len(header) + size)
+    return np.memmap(
+        path,
+        dtype=np.float32,
+        mode='r+',
+        offset=len(header),
+        shape=shape,
+    )
+
+
+def splice(
+    result: np.ndarray[typing.Any, np.dtype[typing.Any]],
+    denoised: np.ndarray[typing.Any, np.dtype[typing.Any]],
+    segs: typing.Sequence[tuple[int, int]],
+    *,
+    gain: float,
+    xfade: int,
+) -> None:
+    """Splice denoised segments into an attenuated recording, in place.
+
+    The result is scaled by gain outside of the segments,
+    which are taken one after another from denoised
+    and crossfaded with the attenuated surroundings over xfade samples.
+    """
+    for beg in range(0, len(result), _CHUNK):
+        result[beg : beg + _CHUNK] *= gain
+    pos = 0
+    for b, e in segs:
+        piece = _as_float32(denoised[pos : pos + e - b])
+        pos += e - b
+        f = min(xfade, (e - b) // 2)
+        ramp = np.linspace(0, 1, f, dtype=np.float32)
+        if result.ndim > 1:
+            ramp = ramp[:, None]
+        result[b + f : e - f] = piece[f : e - b - f]
+        head, tail = slice(b, b + f), slice(e - f, e)
+        result[head] = result[head] * (1 - ramp) + piece[:f] * ramp
+        result[tail] = result[tail] * ramp + piece[e - b - f :] * (1 - ramp)
+
+
+def _improve_voiced_48k(  # noqa: PLR0913
+    out: Path,
+    inp: Path,
+    tmp_dir: Path,
+    cmd_prefix: typing.Sequence[str],
+    *,
+    attenuation_db: float,
+    unvoiced_attenuation_db: float,
+) -> float:
+    """Denoise just the voiced regions of a float32 WAV, attenuate the rest.
+
+    The voiced regions are concatenated and denoised in one go,
+    then spliced back with crossfades.
+    Returns the voiced fraction.
+    """
+    log = structlog.get_logger()
+    rate, data = scipy.io.wavfile.read(inp, mmap=True)
+    if not len(data):  # nothing to denoise, and it can't be memmapped
+        shutil.copy(inp, out)
+        return 0.0
+    segs = autosync_voice.vad.segments(data, rate)
+    voiced_len = sum(e - b for b, e in segs)
+    voiced_fraction = voiced_len / max(len(data), 1)
+    log.debug('voiced segments', segments=len(segs), voiced=voiced_len)
+    if voiced_fraction > VAD_WORTH_IT:
+        _improve_48k(out, inp, tmp_dir, cmd_prefix, attenuation_db)
+        return voiced_fraction
+
+    denoised = np.empty((0, *data.shape[1:]), dtype=np.float32)
+    if segs:
+        vinp, vout = tmp_dir / 'voiced.wav', tmp_dir / 'voiced.i.wav'
+        # concatenated on disk, segment by segment, not to hold it all in RAM
+        voiced = _float32_wav(vinp, rate, (voiced_len, *data.shape[1:]))
+        pos = 0
+        for b, e in segs:
+            voiced[pos : pos + e - b] = _as_float32(data[b:e])
+            pos += e - b
+        voiced.flush()
+        del voiced
+        _improve_48k(vout, vinp, tmp_dir, cmd_prefix, attenuation_db)
+        _, denoised = scipy.io.wavfile.read(vout, mmap=True)
+        assert len(denoised) >= voiced_len
+
+    # start with a copy, attenuated and spliced into in place
+    shutil.copy(inp, out)
+    result = np.memmap(
+        out,
+        dtype=data.dtype,
+        mode='r+',
+        offset=data.offset,
+        shape=data.shape,
+    )
+    splice(
+        result,
+        denoised,
+        segs,
+        gain=10 ** (-unvoiced_attenuation_db / 20),
+        xfade=int(XFADE * rate),
+    )
+    result.flush()
+    return voiced_fraction
+
+
+def improve(  # noqa: PLR0913
+    out: Path,
+    inp: Path,
+    *,
+    cmd_prefix: typing.Sequence[str] = (),
+    cache: autosync_voice.pcm_cache.PCMCache | None = None,
+    vad: bool = False,
+    attenuation_db: float = 20,
+    unvoiced_attenuation_db: float = 20,
+) -> None:
+    """Improve a recording (de-noise, etc).
+
+    The 48 kHz input is taken from the PCM cache
+    (if there's none, a throwaway one is used),
+    so pass the raw FLAC rather than the export to share it with export.
+    DeepFilterNet attenuates the noise by attenuation_db at most.
+    With vad, only the voiced regions are denoised,
+    the rest is attenuated by unvoiced_attenuation_db (0 to keep it as is).
+    """
+    ffmpeg_cmd = [*cmd_prefix, 'ffmpeg']
     with tempfile.TemporaryDirectory() as _tempdir:
         tempdir = Path(_tempdir)
+        cache = cache or autosync_voice.pcm_cache.PCMCache(tempdir / 'pcm')
         out.parent.mkdir(parents=True, exist_ok=True)
         tmp = out.with_suffix('.tmp.opus')
-        wav, imp = str(tempdir / 'mono.wav'), str(tempdir / 'imp.wav')
-        ffmpeg.input(inp).output(wav, ar=48000, loglevel='quiet').run()
-        _improve_48k(Path(imp), Path(wav), tempdir)
-        stream = ffmpeg.input(imp)
-        stream.output(str(tmp), loglevel='quiet').overwrite_output().run()
+        imp = tempdir / 'imp.wav'
+        with cache.pcm(inp, rate=48000, cmd_prefix=cmd_prefix) as wav:
+            if vad:
+                voiced = _improve_voiced_48k(
+                    imp,
+                    wav,
+                    tempdir,
+                    cmd_prefix,
+                    attenuation_db=attenuation_db,
+                    unvoiced_attenuation_db=unvoiced_attenuation_db,
+                )
+                click.echo(f'{inp} is {voiced:.0%} voiced')
+            else:
+                _improve_48k(imp, wav, tempdir, cmd_prefix, attenuation_db)
+        stream = ffmpeg.input(str(imp))
+        stream = stream.output(str(tmp), loglevel='quiet').overwrite_output()
+        stream.run(cmd=ffmpeg_cmd)
         tmp.rename(out)
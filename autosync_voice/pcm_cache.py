@@ -0,0 +1,143 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""A cache of decoded PCM, shared between the stages.
+
+Entries are float32 WAVs, memory-mappable with scipy.io.wavfile.read,
+keyed by source identity (path, size and modification time)
+and the rate and channel count they've been decoded with.
+Once the cache outgrows its size cap,
+the least recently used entries not in use right now are evicted.
+"""
+
+import contextlib
+import hashlib
+import shutil
+import threading
+import typing
+import uuid
+from pathlib import Path
+
+import ffmpeg  # type: ignore[import-untyped]
+import structlog
+
+RATE = 48000  # the canonical one, Opus and DeepFilterNet want that anyway
+
+
+class PCMCache:
+    """A directory of decoded PCM."""
+
+    directory: Path
+    max_size: int
+    rate: int
+
+    def __init__(  # noqa: D107
+        self,
+        directory: Path,
+        *,
+        max_size: int = 0,  # bytes, 0 for unlimited
+        rate: int = RATE,
+    ) -> None:
+        self.directory, self.max_size, self.rate = directory, max_size, rate
+        self._lock = threading.Lock()
+        self._in_use: dict[Path, int] = {}
+
+    def _path(self, source: Path, rate: int, channels: int | None) -> Path:
+        st = source.stat()
+        identity = f'{source.resolve()}\0{st.st_size}\0{st.st_mtime_ns}'
+        identity += f'\0{rate}\0{channels}'
+        key = hashlib.sha256(identity.encode()).hexdigest()[:32]
+        return self.directory / f'{key}.wav'
+
+    @contextlib.contextmanager
+    def _using(self, path: Path) -> typing.Generator[None, None, None]:
+        with self._lock:
+            self._in_use[path] = self._in_use.get(path, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use[path] -= 1
+                if not self._in_use[path]:
+                    del self._in_use[path]
+
+    @contextlib.contextmanager
+    def pcm(
+        self,
+        source: Path,
+        *,
+        rate: int | None = None,
+        channels: int | None = None,  # None to keep them as they are
+        cmd_prefix: typing.Sequence[str] = (),
+    ) -> typing.Generator[Path, None, None]:
+        """Provide a float32 WAV of the source, decoding it if needed.
+
+        The entry won't be evicted until the context is exited.
+
+        Yields:
+            The path to the WAV.
+
+        """
+        log = structlog.get_logger()
+        rate = rate or self.rate
+        path = self._path(source, rate, channels)
+        with self._using(path):
+            if path.exists():
+                log.debug('pcm cache hit', source=source, path=path)
+                path.touch()
+            else:
+                log.debug('pcm cache miss', source=source, path=path)
+                self.directory.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(f'.{uuid.uuid4().hex}.part')
+                kwargs = {'ac': channels} if channels else {}
+                stream = ffmpeg.input(str(source)).output(
+                    str(tmp),
+                    format='wav',
+                    acodec='pcm_f32le',
+                    ar=rate,
+                    loglevel='quiet',
+                    **kwargs,
+                )
+                stream.overwrite_output().run(cmd=[*cmd_prefix, 'ffmpeg'])
+                tmp.rename(path)
+                self.evict()
+            yield path
+
+    def add(
+        self,
+        source: Path,
+        wav: Path,
+        *,
+        rate: int | None = None,
+        channels: int | None = None,
+    ) -> None:
+        """Adopt a float32 WAV of the source decoded elsewhere, moving it."""
+        path = self._path(source, rate or self.rate, channels)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f'.{uuid.uuid4().hex}.part')
+        shutil.move(wav, tmp)
+        tmp.rename(path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries exceeding the size cap."""
+        log = structlog.get_logger()
+        if not self.max_size:
+            return
+        entries = []
+        for path in self.directory.glob('*.wav'):
+            with contextlib.suppress(FileNotFoundError):
+                entries.append((path.stat(), path))
+        size = sum(st.st_size for st, _ in entries)
+        for st, path in sorted(entries, key=lambda e: e[0].st_mtime_ns):
+            if size <= self.max_size:
+                break
+            with self._lock:
+                if path in self._in_use:
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    path.unlink()  # mmapped readers don't care
+            size -= st.st_size
+            log.debug('pcm cache evicted', path=path, size=st.st_size)
+        if size > self.max_size:
+            log.debug('pcm cache is over the cap, all in use', size=size)
@@ -0,0 +1,41 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""Deciding which recordings get exported and improved."""
+
+import typing
+from pathlib import Path
+
+Policy = typing.Literal['everything', 'merged_and_unmatched', 'merged']
+POLICIES: tuple[Policy, ...] = typing.get_args(Policy)
+
+# merged: a stereo file made by sync out of a pair
+# matched: a single-device recording that is a part of some pair
+# unmatched: a single-device recording that has no pair
+Kind = typing.Literal['merged', 'matched', 'unmatched']
+
+_WANTED: dict[Policy, frozenset[Kind]] = {
+    'everything': frozenset(('merged', 'matched', 'unmatched')),
+    'merged_and_unmatched': frozenset(('merged', 'unmatched')),
+    'merged': frozenset(('merged',)),
+}
+
+
+def classify(
+    path: Path,
+    devices: typing.Collection[str],
+    matched: typing.Collection[Path],
+) -> Kind:
+    """Tell a merged recording from a single one, matched or not.
+
+    Single recordings live in a directory named after the device,
+    merged ones live in a directory named after a pair of them.
+    """
+    if path.parent.name not in devices:
+        return 'merged'
+    return 'matched' if path in matched else 'unmatched'
+
+
+def is_wanted(policy: Policy, kind: Kind) -> bool:
+    """Check whether a recording of that kind should be processed."""
+    return kind in _WANTED[policy]
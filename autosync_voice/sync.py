@@ -7,50 +7,242 @@
 """Calculating the shift between audio files and merging them."""
 
 import tempfile
+import typing
 from pathlib import Path
 
 import click
 import ffmpeg  # type: ignore[import-untyped]
 import numpy as np
-import scipy.fft  # type: ignore[import-untyped]
 import scipy.io  # type: ignore[import-untyped]
+import scipy.signal  # type: ignore[import-untyped]
 import structlog
 
-SYNC_LEN = 30  # sec
-
-
-def delay_pad(lbeg: Path, rbeg: Path) -> tuple[int, int, int]:
-    """Calculate the delay and required end padding between two mono WAVs."""
-    lrate, ldata = scipy.io.wavfile.read(lbeg)
-    rrate, rdata = scipy.io.wavfile.read(rbeg)
-    assert lrate == rrate
-    ls = len(ldata)
-    rs = len(rdata)
-    padsize = ls + rs + 1
-    padsize = 2 ** (int(np.log(padsize) / np.log(2)) + 1)
-    lpad = np.zeros(padsize)
-    lpad[:ls] = ldata
-    rpad = np.zeros(padsize)
-    rpad[:rs] = rdata
-    corr = scipy.fft.ifft(scipy.fft.fft(lpad) * np.conj(scipy.fft.fft(rpad)))
-    xmax = int(np.argmax(np.absolute(corr)))
-    if xmax > padsize // 2:  # left one needs to be delayed
-        delay = +(int(padsize) - xmax)
-        ls_new, rs_new = delay + ls, rs
-    else:  # right one needs to be delayed
-        delay = -(xmax)
-        ls_new, rs_new = ls, rs - delay
+import autosync_voice.pcm_cache
+import autosync_voice.vad
+
+SYNC_LEN = 30  # sec, of a single window to correlate
+MAX_WINDOWS = 8  # to escalate to if the delay is still ambiguous
+MAX_DELAY = 180  # sec, matchmake pairs recordings started within minutes
+FINE_MARGIN = 1.0  # sec, to search around a delay guessed from the envelopes
+CANDIDATES = 3  # envelope correlation peaks to try
+MIN_CONFIDENCE = 25.0  # correlation peak over the median, in MADs
+MIN_LEN = 2 * FINE_MARGIN + 1  # sec, shorter tracks can't be aligned
+
+if typing.TYPE_CHECKING:
+    Array = np.ndarray[typing.Any, np.dtype[typing.Any]]
+    FloatArray = np.ndarray[typing.Any, np.dtype[np.float64]]
+
+
+class SyncError(click.ClickException):
+    """The tracks couldn't be aligned confidently enough."""
+
+
+def activity(data: 'Array', rate: int) -> 'FloatArray':
+    """Calculate a per-frame envelope of loudness over the noise floor, dB."""
+    energy = autosync_voice.vad.energy(data, rate)
+    if not len(energy):
+        return energy
+    floor = np.percentile(energy, autosync_voice.vad.NOISE_FLOOR_PERCENTILE)
+    act: FloatArray = np.maximum(energy - floor, 0)
+    return act
+
+
+def candidates(lact: 'FloatArray', ract: 'FloatArray', rate: int) -> list[int]:
+    """Guess the delays by correlating activity envelopes, best first.
+
+    The delay is the one of the left track against the right one, in samples.
+    """
+    flen = int(autosync_voice.vad.FRAME_LEN * rate)
+    max_delay = int(MAX_DELAY / autosync_voice.vad.FRAME_LEN)
+    lact, ract = lact - lact.mean(), ract - ract.mean()
+    corr = scipy.signal.correlate(ract, lact, method='fft')
+    lags = scipy.signal.correlation_lags(len(ract), len(lact))
+    within = np.abs(lags) <= max_delay
+    corr, lags = corr[within], lags[within]
+    separation = int(FINE_MARGIN / autosync_voice.vad.FRAME_LEN)
+    peaks, _ = scipy.signal.find_peaks(corr, distance=separation)
+    best = peaks[np.argsort(corr[peaks])[::-1][:CANDIDATES]]
+    return [int(lag) * flen for lag in lags[best]]
+
+
+def windows(
+    lact: 'FloatArray',
+    ract: 'FloatArray',
+    rate: int,
+    delay: int,
+) -> list[tuple[int, int]]:
+    """Pick the windows where both tracks are the most active, in samples.
+
+    Only the windows that overlap given the delay
+    (with a margin to refine it) are considered, the best ones come first.
+    """
+    frame_len = autosync_voice.vad.FRAME_LEN
+    flen = int(frame_len * rate)
+    fdelay = round(delay / flen)
+    margin = int(np.ceil(FINE_MARGIN / frame_len)) + 1
+    beg = max(0, -fdelay) + margin
+    end = min(len(lact), len(ract) - fdelay) - margin
+    length = min(int(SYNC_LEN / frame_len), end - beg)
+    if length <= 0:
+        return []
+    both = np.minimum(lact[beg:end], ract[beg + fdelay : end + fdelay])
+    cumsum = np.concatenate(([0], np.cumsum(both)))
+    scores = cumsum[length:] - cumsum[:-length]
+    picked: list[tuple[int, int]] = []
+    for _ in range(MAX_WINDOWS):
+        i = int(np.argmax(scores))
+        if scores[i] <= 0:
+            break
+        picked.append(((beg + i) * flen, (beg + i + length) * flen))
+        scores[max(0, i - length + 1) : i + length] = -np.inf
+    return picked
+
+
+def _confidence(corr: 'FloatArray') -> float:
+    a = np.abs(corr)
+    i = int(np.argmax(a))
+    if i in {0, len(a) - 1}:  # the peak is likely beyond the margin
+        return 0.0
+    median = np.median(a)
+    mad = np.median(np.abs(a - median)) or 1e-12
+    return float((a[i] - median) / mad)
+
+
+def refine(
+    ldata: 'Array',
+    rdata: 'Array',
+    rate: int,
+    delay: int,
+    wins: typing.Sequence[tuple[int, int]],
+) -> typing.Iterator[tuple[int, float]]:
+    """Refine the delay, escalating to more windows, with its confidence.
+
+    Correlations of the windows are summed up,
+    which is like correlating a longer window
+    without having to transform it all at once.
+
+    Yields:
+        The delay and its confidence after 1, 2, 4... windows.
+
+    """
+    margin = int(FINE_MARGIN * rate)
+    acc = np.zeros(2 * margin + 1)
+    for n, (beg, end) in enumerate(wins, start=1):
+        lwin = np.asarray(ldata[beg:end], dtype=np.float64)
+        rbeg, rend = beg + delay - margin, end + delay + margin
+        rwin = np.asarray(rdata[rbeg:rend], dtype=np.float64)
+        acc += scipy.signal.correlate(rwin, lwin, mode='valid', method='fft')
+        if n & (n - 1) == 0 or n == len(wins):
+            i = int(np.argmax(np.abs(acc)))
+            yield delay - margin + i, _confidence(acc)
+
+
+def align(ldata: 'Array', rdata: 'Array', rate: int) -> tuple[int, float]:
+    """Calculate the delay of the left mono track against the right one.
+
+    Both are expected to be of the same rate.
+    The delay is first guessed from the activity envelopes,
+    then refined by correlating the windows where both tracks are active,
+    escalating to more of them until the correlation peak stands out.
+
+    Raises:
+        SyncError: if it never does, or there's nothing to correlate.
+
+    """
+    log = structlog.get_logger()
+    if min(len(ldata), len(rdata)) < MIN_LEN * rate:
+        msg = f'a track is shorter than {MIN_LEN}s'
+        raise SyncError(msg)
+    lact, ract = activity(ldata, rate), activity(rdata, rate)
+    guesses = candidates(lact, ract, rate)
+    if not guesses:
+        msg = 'no delay could be guessed from the activity'
+        raise SyncError(msg)
+    best_delay, best_confidence, tried = 0, 0.0, False
+    for guess in guesses:
+        wins = windows(lact, ract, rate, guess)
+        tried = tried or bool(wins)
+        for delay, confidence in refine(ldata, rdata, rate, guess, wins):
+            log.debug(
+                'delay estimated',
+                guess=guess / rate,
+                delay=delay / rate,
+                confidence=confidence,
+            )
+            if confidence >= MIN_CONFIDENCE:
+                return delay, confidence
+            if confidence > best_confidence:
+                best_delay, best_confidence = delay, confidence
+    if not tried:
+        msg = 'the tracks are never active together'
+        raise SyncError(msg)
+    msg = (
+        f'no confident delay found, best guess is {best_delay / rate:.3f}s '
+        f'with confidence {best_confidence:.1f} < {MIN_CONFIDENCE}'
+    )
+    raise SyncError(msg)
+
+
+def pads(ls: int, rs: int, delay: int) -> tuple[int, int]:
+    """Calculate the end padding to even out the lengths of delayed tracks.
+
+    >>> pads(10, 15, 3)
+    (2, 0)
+    >>> pads(10, 15, -3)
+    (8, 0)
+    """
+    ls_new, rs_new = ls + max(delay, 0), rs + max(-delay, 0)
     len_new = max(ls_new, rs_new)
-    return delay, len_new - ls_new, len_new - rs_new
+    return len_new - ls_new, len_new - rs_new
 
 
 def _fsec(f: float) -> str:
     return f'{f:5.3}s' if f > 0 else ' ' * 6
 
 
-def sync(out: Path, lin: Path, rin: Path) -> None:  # noqa: PLR0914
-    """Sync and merge together a pair of recordings."""
+def _join(
+    lwav: Path,
+    rwav: Path,
+    delay: int,
+    lpad: int,
+    rpad: int,
+) -> typing.Any:  # noqa: ANN401
+    linput = ffmpeg.input(str(lwav))
+    rinput = ffmpeg.input(str(rwav))
+    if delay > 0:
+        linput = linput.filter('adelay', f'{delay}S')
+    else:
+        rinput = rinput.filter('adelay', f'{-delay}S')
+    if lpad:
+        linput = linput.filter('apad', pad_len=lpad)
+    if rpad:
+        rinput = rinput.filter('apad', pad_len=rpad)
+    return ffmpeg.filter(
+        (linput, rinput),
+        'join',
+        inputs=2,
+        channel_layout='stereo',
+    )
+
+
+def sync(  # noqa: PLR0914
+    out: Path,
+    lin: Path,
+    rin: Path,
+    *,
+    cmd_prefix: typing.Sequence[str] = (),
+    cache: autosync_voice.pcm_cache.PCMCache | None = None,
+) -> None:
+    """Sync and merge together a pair of recordings.
+
+    The mono tracks are taken from the PCM cache (if there's none, a
+    throwaway one is used), the merged result is put there as well
+    (unless it's a throwaway one).
+    If the tracks can't be aligned confidently, SyncError is raised
+    and nothing is written.
+    """
     log = structlog.getLogger(__name__)
+    ffmpeg_cmd = [*cmd_prefix, 'ffmpeg']
 
     lrate = int(ffmpeg.probe(lin)['streams'][0]['sample_rate'])
     rrate = int(ffmpeg.probe(rin)['streams'][0]['sample_rate'])
@@ -62,47 +254,52 @@ def sync(out: Path, lin: Path, rin: Path) -> None:  # noqa: PLR0914
 
     with tempfile.TemporaryDirectory() as _tempdir:
         tempdir = Path(_tempdir)
-        lwav, rwav = str(tempdir / 'left.wav'), str(tempdir / 'right.wav')
-        lbeg, rbeg = str(tempdir / 'lbeg.wav'), str(tempdir / 'rbeg.wav')
+        keep_pcm = cache is not None
+        cache = cache or autosync_voice.pcm_cache.PCMCache(tempdir / 'pcm')
         tmp = out.with_suffix('.tmp.flac')
-        log.debug(f'{action} the left track to mono WAV...')  # noqa: G004
-        ffmpeg.input(lin).output(lwav, ac=1, ar=ar, loglevel='quiet').run()
-        log.debug(f'{action} the right track to mono WAV...')  # noqa: G004
-        ffmpeg.input(rin).output(rwav, ac=1, ar=ar, loglevel='quiet').run()
-        log.debug('extracting the beginning of the left track...')
-        ffmpeg.input(lwav).output(lbeg, to=SYNC_LEN, loglevel='quiet').run()
-        log.debug('extracting the beginning of the right track...')
-        ffmpeg.input(rwav).output(rbeg, to=SYNC_LEN, loglevel='quiet').run()
-
-        log.debug('calculating the delay between the tracks...')
-        d, lpad, rpad = delay_pad(Path(lbeg), Path(rbeg))
-        log.debug(
-            'delay has been calculated',
-            delay=d / ar,
-            lpad=lpad / ar,
-            rpad=rpad / ar,
-        )
-        click.echo(f'  {_fsec(+d / ar)} + {lin} + {_fsec(lpad / ar)}')
-        click.echo(f'+ {_fsec(-d / ar)} + {rin} + {_fsec(rpad / ar)}')
-        click.echo(f'= {out}')
-
-        log.debug('aligning the delay between the tracks...')
-        out.parent.mkdir(parents=True, exist_ok=True)
-        linput = ffmpeg.input(lwav)
-        rinput = ffmpeg.input(rwav)
-        if d > 0:
-            linput = linput.filter('adelay', f'{d}S')
-        else:
-            rinput = rinput.filter('adelay', f'{-d}S')
-        if lpad:
-            linput = linput.filter('apad', pad_len=lpad)
-        if rpad:
-            rinput = rinput.filter('apad', pad_len=rpad)
-        stream = ffmpeg.filter(
-            (linput, rinput),
-            'join',
-            inputs=2,
-            channel_layout='stereo',
-        )
-        stream.output(str(tmp), loglevel='quiet').overwrite_output().run()
+        merged_pcm = tempdir / 'merged.wav'
+        log.debug(f'{action} the tracks to mono...')  # noqa: G004
+        with (
+            cache.pcm(lin, rate=ar, channels=1, cmd_prefix=cmd_prefix) as lwav,
+            cache.pcm(rin, rate=ar, channels=1, cmd_prefix=cmd_prefix) as rwav,
+        ):
+            _, ldata = scipy.io.wavfile.read(lwav, mmap=True)
+            _, rdata = scipy.io.wavfile.read(rwav, mmap=True)
+
+            log.debug('calculating the delay between the tracks...')
+            d, confidence = align(ldata, rdata, ar)
+            lpad, rpad = pads(len(ldata), len(rdata), d)
+            log.debug(
+                'delay has been calculated',
+                confidence=confidence,
+                delay=d / ar,
+                lpad=lpad / ar,
+                rpad=rpad / ar,
+            )
+            click.echo(f'  {_fsec(+d / ar)} + {lin} + {_fsec(lpad / ar)}')
+            click.echo(f'+ {_fsec(-d / ar)} + {rin} + {_fsec(rpad / ar)}')
+            click.echo(f'= {out}')
+
+            log.debug('aligning the delay between the tracks...')
+            out.parent.mkdir(parents=True, exist_ok=True)
+            stream = _join(lwav, rwav, d, lpad, rpad)
+            outputs = []
+            if keep_pcm:  # write the merged PCM as well, for exporting
+                split = stream.filter_multi_output('asplit')
+                stream = split[0]
+                resampled = split[1].filter('aresample', cache.rate)
+                outputs.append(
+                    resampled.output(
+                        str(merged_pcm),
+                        acodec='pcm_f32le',
+                        loglevel='quiet',
+                    ),
+                )
+            outputs.append(
+                stream.output(str(tmp), sample_fmt='s16', loglevel='quiet'),
+            )
+            stream = ffmpeg.merge_outputs(*outputs)
+            stream.overwrite_output().run(cmd=ffmpeg_cmd)
         tmp.rename(out)
+        if keep_pcm:
+            cache.add(out, merged_pcm)
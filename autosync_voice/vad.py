@@ -0,0 +1,112 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""Telling voiced regions from silence and room tone, cheaply.
+
+Short frames are judged by their energy over the noise floor
+and by their spectral flux, both calculated over blocks of frames
+so that long recordings can be streamed from memory-mapped files.
+"""
+
+import typing
+
+import numpy as np
+
+FRAME_LEN = 0.02  # seconds
+BLOCK_FRAMES = 3000  # frames to process at once
+NOISE_FLOOR_PERCENTILE = 10
+ENERGY_MARGIN = 10.0  # dB over the noise floor to be voiced for sure
+FLUX_MARGIN = 3.0  # median absolute deviations over the median flux
+PAD = 0.3  # seconds of context to add around voiced regions
+MIN_GAP = 1.0  # seconds, shorter gaps between voiced regions are bridged
+
+if typing.TYPE_CHECKING:
+    Array = np.ndarray[typing.Any, np.dtype[typing.Any]]
+    FloatArray = np.ndarray[typing.Any, np.dtype[np.float64]]
+
+
+def _blocks(
+    data: 'Array',
+    flen: int,
+) -> typing.Iterator[tuple[int, int, 'FloatArray']]:
+    # blocks of mono frames of flen samples each, with their frame span
+    n = len(data) // flen
+    for beg in range(0, n, BLOCK_FRAMES):
+        end = min(beg + BLOCK_FRAMES, n)
+        block = np.asarray(data[beg * flen : end * flen], dtype=np.float64)
+        if block.ndim > 1:
+            block = block.mean(axis=1)
+        yield beg, end, block.reshape(end - beg, flen)
+
+
+def _energy(frames: 'FloatArray') -> 'FloatArray':
+    e: FloatArray = 10 * np.log10(np.mean(frames**2, axis=1) + 1e-12)
+    return e
+
+
+def energy(data: 'Array', rate: int) -> 'FloatArray':
+    """Calculate per-frame energy (dB), block by block."""
+    flen = int(FRAME_LEN * rate)
+    e = np.empty(len(data) // flen)
+    for beg, end, frames in _blocks(data, flen):
+        e[beg:end] = _energy(frames)
+    return e
+
+
+def features(data: 'Array', rate: int) -> tuple['FloatArray', 'FloatArray']:
+    """Calculate per-frame energy (dB) and spectral flux, block by block."""
+    flen = int(FRAME_LEN * rate)
+    n = len(data) // flen
+    loudness, flux = np.empty(n), np.empty(n)
+    window = np.hanning(flen)
+    prev_spec = None
+    for beg, end, frames in _blocks(data, flen):
+        loudness[beg:end] = _energy(frames)
+        spec = np.log1p(np.abs(np.fft.rfft(frames * window, axis=1)))
+        prev = np.vstack((spec[:1] if prev_spec is None else prev_spec, spec))
+        flux[beg:end] = np.maximum(spec - prev[:-1], 0).mean(axis=1)
+        prev_spec = spec[-1:]
+    return loudness, flux
+
+
+def voiced_frames(
+    energy: 'FloatArray',
+    flux: 'FloatArray',
+) -> np.ndarray[typing.Any, np.dtype[np.bool_]]:
+    """Tell which frames are voiced.
+
+    >>> energy = np.array([-60, -60, -30, -60, -52, -60, -60, -60, -60, -60])
+    >>> flux = np.array([0, 0, 1, 0, 0.5, 0, 0, 0, 0, 0])
+    >>> voiced_frames(energy, flux).nonzero()[0].tolist()
+    [2, 4]
+    """
+    floor = np.percentile(energy, NOISE_FLOOR_PERCENTILE)
+    median = np.median(flux)
+    mad = np.median(np.abs(flux - median))
+    loud = energy > floor + ENERGY_MARGIN
+    lively = flux > median + FLUX_MARGIN * mad
+    voiced: np.ndarray[typing.Any, np.dtype[np.bool_]]
+    voiced = loud | (lively & (energy > floor + ENERGY_MARGIN / 2))
+    return voiced
+
+
+def segments(data: 'Array', rate: int) -> list[tuple[int, int]]:
+    """Find voiced segments, padded and with short gaps bridged, in samples."""
+    flen = int(FRAME_LEN * rate)
+    energy, flux = features(data, rate)
+    if not len(energy):  # shorter than a frame
+        return []
+    voiced = voiced_frames(energy, flux)
+    n, pad, min_gap = len(voiced), round(PAD / FRAME_LEN), MIN_GAP / FRAME_LEN
+    edges = np.flatnonzero(np.diff(voiced, prepend=False, append=False))
+    segs: list[tuple[int, int]] = []
+    for beg, end in zip(edges[::2], edges[1::2], strict=True):
+        b, e = max(0, int(beg) - pad), min(n, int(end) + pad)
+        if segs and b - segs[-1][1] <= min_gap:
+            segs[-1] = segs[-1][0], e
+        else:
+            segs.append((b, e))
+    return [
+        (b * flen, len(data) if e == n else e * flen)  # including the tail
+        for b, e in segs
+    ]
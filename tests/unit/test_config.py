@@ -0,0 +1,40 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""Test pieces of config module."""
+
+import typing
+
+import pytest
+
+from autosync_voice.config import validate
+
+if typing.TYPE_CHECKING:
+    from autosync_voice.config import Config
+
+
+def _config(**kwargs: typing.Any) -> 'Config':  # noqa: ANN401
+    config = {
+        'storage': {'raw': '/raw'},
+        'devices': {'a': {'glob': '*.wav', 'directory': '/a'}},
+        **kwargs,
+    }
+    return typing.cast('Config', config)
+
+
+def test_validate_governor() -> None:
+    """Test filling in the stage defaults."""
+    config = validate(_config())
+    assert config['governor']['stages']['import']['max_workers'] == 1
+    assert config['governor']['stages']['improve']['max_load'] == float('inf')
+    config = validate(
+        _config(governor={'stages': {'export': {'max_workers': 4}}}),
+    )
+    assert config['governor']['stages']['export']['max_workers'] == 4  # noqa: PLR2004
+    assert config['governor']['stages']['export']['budget'] == 0
+
+
+def test_validate_import_not_deferrable() -> None:
+    """Test rejecting deferral settings for the import stage."""
+    with pytest.raises(AssertionError):
+        validate(_config(governor={'stages': {'import': {'budget': 60}}}))
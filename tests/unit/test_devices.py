@@ -0,0 +1,50 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""Test pieces of devices module."""
+
+import typing
+
+from autosync_voice.config import validate
+from autosync_voice.devices import DirectoryDevice, detect_devices
+
+if typing.TYPE_CHECKING:
+    from pathlib import Path
+
+    from autosync_voice.config import Config
+
+
+def test_directory_device(tmp_path: 'Path') -> None:
+    """Test detecting and importing-tracking of a directory device."""
+    share = tmp_path / 'share'
+    share.mkdir()
+    config_dict = {
+        'storage': {
+            'raw': str(tmp_path / 'raw'),
+            'meta': str(tmp_path / 'meta'),
+            'processed': str(tmp_path / 'processed'),
+            'processed_list': str(tmp_path / 'processed.list'),
+        },
+        'devices': {
+            'share': {
+                'glob': '*.wav',
+                'directory': str(share),
+            },
+            'missing': {
+                'glob': '*.wav',
+                'directory': str(tmp_path / 'missing'),
+            },
+        },
+    }
+    config = validate(typing.cast('Config', config_dict))
+
+    (share / 'autosync-voice.toml').write_text('device_name = "share"')
+    (share / '240211_1904.wav').touch()
+    (device,) = detect_devices(config)
+    assert isinstance(device, DirectoryDevice)
+    assert device.name == 'share'
+    assert device.check_mount() == share
+    assert not device.is_imported(config)
+    device.mark_imported(config)
+    (device,) = detect_devices(config)
+    assert device.is_imported(config)
@@ -0,0 +1,57 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""Test pieces of flac module."""
+
+from autosync_voice.flac import (
+    _frame_offsets,  # noqa: PLC2701
+    _parse_frame_header,  # noqa: PLC2701
+    _renumber_frame,  # noqa: PLC2701
+    _seektable,  # noqa: PLC2701
+    crc8,
+    crc16,
+    encode_number,
+)
+
+
+def _frame(n: int, body: bytes, channels_bps: int = 0x08) -> bytes:
+    # 4608 samples (blocksize code 5), 48 kHz (10), mono 16 bit (0x08)
+    header = b'\xff\xf8\x5a' + bytes((channels_bps,)) + encode_number(n)
+    header += bytes((crc8(header),))
+    return header + body + crc16(header + body).to_bytes(2)
+
+
+def test_renumber_frame() -> None:
+    """Test renumbering frames, both keeping and changing header length."""
+    body = bytes(range(256)) * 40
+    for old, new in ((0, 1), (3, 2**20), (2**20, 7), (2**30, 2**35)):
+        frame = _renumber_frame(_frame(old, body), new)
+        assert frame == _frame(new, body)
+        assert _parse_frame_header(frame, 0) == (
+            new,
+            len(encode_number(new)),
+            len(encode_number(new)) + 5,
+        )
+
+
+def test_frame_offsets_stereo() -> None:
+    """Test finding frames with the stereo mode changing between them."""
+    streaminfo = b'\x80' + (34).to_bytes(3) + bytes(34)  # the last block
+    data = b'fLaC' + streaminfo
+    offsets = []
+    # independent, left/side, independent, mid/side; all 16 bit
+    for n, channels_bps in enumerate((0x18, 0x88, 0x18, 0xA8)):
+        offsets.append(len(data))
+        data += _frame(n, bytes(range(256)) * 40, channels_bps)
+    assert _frame_offsets(data) == offsets
+
+
+def test_seektable() -> None:
+    """Test building a SEEKTABLE, with a placeholder for an unknown frame."""
+    rate, total = 4608, 4608 * 25  # a frame a second
+    table = _seektable(total, rate, {0: 0, 10: 1000})
+    assert table == (
+        bytes(16) + (4608).to_bytes(2)
+        + (46080).to_bytes(8) + (1000).to_bytes(8) + (4608).to_bytes(2)
+        + b'\xff' * 8 + bytes(10)
+    )  # fmt: skip
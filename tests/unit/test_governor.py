@@ -0,0 +1,80 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""Test pieces of governor module."""
+
+import os
+import typing
+
+import pytest
+
+from autosync_voice.governor import apply_to_process, cmd_prefix, run, workers
+
+if typing.TYPE_CHECKING:
+    from autosync_voice.config import GovernorConfig, StageConfig
+
+
+def _sconfig(**kwargs: typing.Any) -> 'StageConfig':  # noqa: ANN401
+    sconfig: StageConfig = {
+        'nice': 0,
+        'ionice': 'none',
+        'max_workers': 3,
+        'max_load': float('inf'),
+        'idle_load': 0.0,
+        'budget': 0,
+        'mem_per_worker_mb': 0,
+        'tmp_per_worker_mb': 0,
+    }
+    sconfig.update(kwargs)  # type: ignore[typeddict-item]
+    return sconfig
+
+
+def test_apply_to_process(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test increasing the niceness rather than setting it."""
+    increments: list[int] = []
+
+    def nice(increment: int) -> int:
+        increments.append(increment)
+        return 10 + increment
+
+    monkeypatch.setattr(os, 'nice', nice)
+    gconfig: GovernorConfig = {'nice': 5, 'ionice': 'none', 'stages': {}}
+    apply_to_process(gconfig)
+    assert increments == [5]
+    gconfig['nice'] = 0
+    apply_to_process(gconfig)
+    assert increments == [5]
+
+
+def test_cmd_prefix() -> None:
+    """Test wrapping child processes into nice and ionice."""
+    assert cmd_prefix(_sconfig()) == ()
+    assert cmd_prefix(_sconfig(nice=5, ionice='idle')) == (
+        'nice', '-n', '5', 'ionice', '-c', '3',
+    )  # fmt: skip
+
+
+def test_workers() -> None:
+    """Test scaling the number of workers."""
+    assert 1 <= workers(_sconfig()) <= 3  # noqa: PLR2004
+    assert workers(_sconfig(max_load=-1)) == 0
+    assert workers(_sconfig(mem_per_worker_mb=2**40)) == 0
+
+
+def test_workers_own_load(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test not holding the load of the running jobs against the stage."""
+    cpus = os.cpu_count() or 1
+    monkeypatch.setattr(os, 'getloadavg', lambda: (cpus / 2 + 2, 0, 0))
+    assert workers(_sconfig(max_load=0.5)) == 0
+    assert workers(_sconfig(max_load=0.5), running=2) >= 1
+
+
+def test_run() -> None:
+    """Test running all the jobs or deferring them all."""
+    done: list[int] = []
+    jobs = [lambda i=i: done.append(i) for i in range(10)]
+    run(_sconfig(), 'export', jobs)
+    assert sorted(done) == list(range(10))
+    done.clear()
+    run(_sconfig(max_load=-1), 'export', jobs)
+    assert not done
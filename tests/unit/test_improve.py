@@ -0,0 +1,82 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""Test pieces of improve module."""
+
+import typing
+from pathlib import Path
+
+import numpy as np
+import pytest
+import scipy.io  # type: ignore[import-untyped]
+
+import autosync_voice.improve
+from autosync_voice.improve import splice
+
+
+def test_splice() -> None:
+    """Test splicing denoised segments into an attenuated recording."""
+    result = np.ones((1000, 2), dtype=np.float32)
+    segs = [(100, 300), (500, 520)]
+    denoised = np.full((220, 2), 5, dtype=np.float32)
+    denoised[200:] = 7
+    splice(result, denoised, segs, gain=0.1, xfade=20)
+    assert np.allclose(result[:100], 0.1)
+    assert np.allclose(result[120:280], 5)
+    assert np.allclose(result[300:500], 0.1)
+    assert np.allclose(result[509:511], 7)  # the crossfades meet
+    assert np.allclose(result[520:], 0.1)
+    # the ramps are continuous, monotonic and end where they should
+    for ramp, start, end in (
+        (result[99:121, 0], 0.1, 5),
+        (result[279:301, 0], 5, 0.1),
+        (result[499:511, 0], 0.1, 7),
+    ):
+        assert np.isclose(ramp[0], start)
+        assert np.isclose(ramp[-1], end)
+        steps = np.diff(ramp) * np.sign(end - start)
+        assert (steps >= 0).all()
+        assert steps.max() <= abs(end - start) / 5
+
+
+@pytest.mark.parametrize(('unvoiced_db', 'unvoiced_gain'), [(20, 0.1), (0, 1)])
+def test_improve_voiced(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    unvoiced_db: float,
+    unvoiced_gain: float,
+) -> None:
+    """Test denoising just the voiced regions of a WAV, in place."""
+
+    def halve(out: Path, inp: Path, *_: typing.Any) -> None:  # noqa: ANN401
+        rate, data = scipy.io.wavfile.read(inp)
+        scipy.io.wavfile.write(out, rate, data / 2)
+
+    monkeypatch.setattr(autosync_voice.improve, '_improve_48k', halve)
+    rate = 8000
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(rate * 60, 2)) * 0.003
+    t = np.arange(rate * 5) / rate
+    tone = 0.3 * np.sin(2 * np.pi * 220 * t)[:, None]
+    data[rate * 20 : rate * 25] += tone
+    data[rate * 40 : rate * 45] += tone
+    data = data.astype(np.float32)
+    inp, out = tmp_path / 'in.wav', tmp_path / 'out.wav'
+    scipy.io.wavfile.write(inp, rate, data)
+    voiced = autosync_voice.improve._improve_voiced_48k(  # noqa: SLF001
+        out,
+        inp,
+        tmp_path,
+        (),
+        attenuation_db=20,
+        unvoiced_attenuation_db=unvoiced_db,
+    )
+    assert 0.1 < voiced < 0.3  # noqa: PLR2004
+    _, result = scipy.io.wavfile.read(out)
+    for beg, end in (20, 25), (40, 45):
+        voiced_part = slice(rate * beg + rate // 10, rate * end - rate // 10)
+        assert np.allclose(result[voiced_part], data[voiced_part] / 2)
+    for beg, end in (0, 19), (26, 39), (46, 60):
+        quiet_part = slice(rate * beg, rate * end)
+        expected = data[quiet_part] * unvoiced_gain
+        assert np.allclose(result[quiet_part], expected, atol=0)
@@ -0,0 +1,39 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""Test pieces of pcm_cache module."""
+
+import typing
+
+import numpy as np
+import scipy.io  # type: ignore[import-untyped]
+
+from autosync_voice.pcm_cache import PCMCache
+
+if typing.TYPE_CHECKING:
+    from pathlib import Path
+
+
+def test_add_hit_evict(tmp_path: 'Path') -> None:
+    """Test adopting entries, using them and evicting the unused ones."""
+    cache = PCMCache(tmp_path / 'cache', max_size=100_000)
+    sources = [tmp_path / f'{i}.flac' for i in range(3)]
+    for i, source in enumerate(sources):
+        source.write_text(str(i))
+        wav = tmp_path / 'decoded.wav'
+        data = np.full(10_000, i, dtype=np.float32)  # 40 KB each
+        scipy.io.wavfile.write(wav, 48000, data)
+        if i == 2:  # noqa: PLR2004
+            # the first one is in use, so the second one gets evicted
+            with cache.pcm(sources[0]) as first:
+                cache.add(source, wav)
+                assert first.exists()
+        else:
+            cache.add(source, wav)
+        assert not wav.exists()
+    assert len(list((tmp_path / 'cache').glob('*.wav'))) == 2  # noqa: PLR2004
+    for i in 0, 2:
+        with cache.pcm(sources[i]) as wav:
+            rate, data = scipy.io.wavfile.read(wav, mmap=True)
+            assert rate == 48000  # noqa: PLR2004
+            assert (data == i).all()
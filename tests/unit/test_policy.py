@@ -0,0 +1,26 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""Test pieces of policy module."""
+
+from pathlib import Path
+
+from autosync_voice.policy import classify, is_wanted
+
+
+def test_classify() -> None:
+    """Test telling merged, matched and unmatched recordings apart."""
+    day = Path('raw/2024-02-11')
+    devices, matched = {'a', 'b'}, {day / 'a' / '1904.flac'}
+    assert classify(day / 'a-b' / '1904.flac', devices, matched) == 'merged'
+    assert classify(day / 'a' / '1904.flac', devices, matched) == 'matched'
+    assert classify(day / 'b' / '2000.flac', devices, matched) == 'unmatched'
+
+
+def test_is_wanted() -> None:
+    """Test which kinds of recordings each policy wants."""
+    assert is_wanted('everything', 'matched')
+    assert is_wanted('merged_and_unmatched', 'unmatched')
+    assert not is_wanted('merged_and_unmatched', 'matched')
+    assert is_wanted('merged', 'merged')
+    assert not is_wanted('merged', 'unmatched')
@@ -0,0 +1,62 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""Test pieces of sync module."""
+
+import numpy as np
+import pytest
+
+from autosync_voice.sync import SyncError, align
+
+RATE = 8000
+
+
+def _chatter(rng: np.random.Generator, n: int, start: int) -> np.ndarray:
+    """Generate bursts of noise separated by pauses, starting at start."""
+    x = np.zeros(n)
+    t = start
+    while t < n:
+        dur = int(rng.uniform(0.1, 0.4) * RATE)
+        burst = rng.normal(size=dur) * np.hanning(dur) * rng.uniform(0.2, 1)
+        x[t : t + dur] = burst[: n - t]
+        t += dur + int(rng.exponential(0.3) * RATE)
+    return x
+
+
+def test_align_quiet_start() -> None:
+    """Test aligning tracks that start with a minute of mere noise."""
+    rng = np.random.default_rng(0)
+    n, delay = 120 * RATE, int(4.321 * RATE)
+    src = _chatter(rng, n + delay, 60 * RATE) * 0.3
+    left = src[delay : delay + n] + rng.normal(size=n) * 0.01
+    right = 0.5 * src[:n] + rng.normal(size=n) * 0.01
+    d, _ = align(left, right, RATE)
+    assert d == delay
+
+
+def test_align_unrelated() -> None:
+    """Test refusing to align unrelated tracks."""
+    rng = np.random.default_rng(0)
+    n = 120 * RATE
+    left = _chatter(rng, n, 0) + rng.normal(size=n) * 0.01
+    right = _chatter(rng, n, 0) + rng.normal(size=n) * 0.01
+    with pytest.raises(SyncError):
+        align(left, right, RATE)
+
+
+def test_align_short() -> None:
+    """Test refusing to align empty and very short tracks."""
+    rng = np.random.default_rng(0)
+    track = _chatter(rng, 120 * RATE, 0)
+    for short in np.zeros(0), np.zeros(100), track[: RATE // 2]:
+        with pytest.raises(SyncError):
+            align(track, short, RATE)
+        with pytest.raises(SyncError):
+            align(short, track, RATE)
+
+
+def test_align_silent() -> None:
+    """Test refusing to align tracks that have nothing going on."""
+    silence = np.zeros(120 * RATE)
+    with pytest.raises(SyncError):
+        align(silence, silence, RATE)
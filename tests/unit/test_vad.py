@@ -0,0 +1,29 @@
+# SPDX-FileCopyrightText: 2024 Alexander Sosedkin <monk@unboiled.info>
+# SPDX-License-Identifier: GPL-3.0
+
+"""Test pieces of vad module."""
+
+import numpy as np
+
+from autosync_voice.vad import PAD, segments
+
+
+def test_segments() -> None:
+    """Test finding tones in noise, padded, the close ones bridged."""
+    rate = 8000
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(rate * 120, 2)) * 0.003
+    t = np.arange(rate * 5) / rate
+    tone = 0.3 * np.sin(2 * np.pi * 220 * t)[:, None]
+    for start in 30, 60, 65.5:
+        data[int(start * rate) : int(start * rate) + len(tone)] += tone
+    segs = [(b / rate, e / rate) for b, e in segments(data, rate)]
+    assert len(segs) == 2  # noqa: PLR2004
+    assert np.allclose(segs[0], (30 - PAD, 35 + PAD), atol=0.05)
+    assert np.allclose(segs[1], (60 - PAD, 70.5 + PAD), atol=0.05)
+
+
+def test_segments_short() -> None:
+    """Test that there are no segments in less than a frame."""
+    assert not segments(np.zeros(0), 8000)
+    assert not segments(np.zeros((100, 2)), 8000)